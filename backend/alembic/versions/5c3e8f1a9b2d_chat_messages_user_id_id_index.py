@@ -0,0 +1,38 @@
+"""chat_messages (user_id, id) index
+
+Revision ID: 5c3e8f1a9b2d
+Revises: 2bc1a47a3911
+Create Date: 2026-10-18 09:12:04.118230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c3e8f1a9b2d'
+down_revision: Union[str, Sequence[str], None] = '2bc1a47a3911'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY: chat_messages keeps taking writes while the index builds
+    # (it can't run inside a transaction, hence the autocommit block)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chat_messages_user_id_id',
+            'chat_messages',
+            ['user_id', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chat_messages_user_id_id', table_name='chat_messages', postgresql_concurrently=True)
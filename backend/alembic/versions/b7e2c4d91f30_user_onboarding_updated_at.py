@@ -0,0 +1,31 @@
+"""user_onboarding updated_at
+
+Revision ID: b7e2c4d91f30
+Revises: 5c3e8f1a9b2d
+Create Date: 2026-10-18 11:27:40.904316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c4d91f30'
+down_revision: Union[str, Sequence[str], None] = '5c3e8f1a9b2d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'user_onboarding',
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('user_onboarding', 'updated_at')
@@ -0,0 +1,48 @@
+"""chat_messages client_msg_id for idempotent submission
+
+Revision ID: c4f8a2d6e913
+Revises: b7e2c4d91f30
+Create Date: 2026-10-18 14:12:05.318274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f8a2d6e913'
+down_revision: Union[str, Sequence[str], None] = 'b7e2c4d91f30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'chat_messages',
+        sa.Column('client_msg_id', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=True),
+    )
+    # NULLs are distinct, so messages without a client id (and assistant replies) never conflict.
+    # The unique index is built CONCURRENTLY (outside a transaction) so the table keeps
+    # serving reads and writes; attaching it as the constraint is then a metadata change.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'uq_chat_messages_user_id_client_msg_id',
+            'chat_messages',
+            ['user_id', 'client_msg_id'],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+    op.execute(
+        'ALTER TABLE chat_messages ADD CONSTRAINT uq_chat_messages_user_id_client_msg_id '
+        'UNIQUE USING INDEX uq_chat_messages_user_id_client_msg_id'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_chat_messages_user_id_client_msg_id', 'chat_messages', type_='unique')
+    op.drop_column('chat_messages', 'client_msg_id')
@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, status
-from typing import List
+from typing import List, Optional
 from app.schema.response import APIResponse
 from app.schema.chat_schema import ChatHistoryResponse
 from app.core.exceptions import AppException
 from sqlmodel import Session, select
 from app.core.dependencies import get_db, get_current_auth_id
 from app.models.chat_models import ChatMessage
+from app.services.user_service.user_service import UserService
 
 from app.core.logger import get_logger
 
@@ -18,32 +19,43 @@ router = APIRouter(prefix="/chat", tags=["Chat"])
 def load_history(
     limit: int = 50,
     offset: int = 0,
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db),
     auth_id: str = Depends(get_current_auth_id) # Using string as it comes from dependency
 ):
-    logger.info(f"Loading chat history for auth_id: {auth_id} (limit: {limit}, offset: {offset})")
-    from app.models.user_model import UserOnboarding
-    
+    """
+    Newest-first chat history.
+    Pass before_id (the previous page's next_cursor) for keyset pagination;
+    offset is kept for older clients and gets slower on deep pages.
+    """
+    logger.info(f"Loading chat history for auth_id: {auth_id} (limit: {limit}, offset: {offset}, before_id: {before_id})")
     try:
-        # 1. Get UserOnboarding id
-        user = db.exec(
-            select(UserOnboarding).where(UserOnboarding.auth_user_id == auth_id)
-        ).first()
-        
-        if not user:
+        # 1. Get UserOnboarding id (cached per process)
+        user_id = UserService(db).get_user_id(auth_id)
+
+        if not user_id:
             return APIResponse.success_response(data=[])
 
-        # 2. Get Messages (DESC for pagination)
+        # 2. Get Messages (DESC for pagination), one extra row to detect a next page
         stmt = (
             select(ChatMessage)
-            .where(ChatMessage.user_id == user.id)
+            .where(ChatMessage.user_id == user_id)
             .order_by(ChatMessage.id.desc())
-            .offset(offset)
-            .limit(limit)
+            .limit(limit + 1)
         )
+        if before_id is not None:
+            # Keyset: an index range scan on (user_id, id), same cost for every page
+            stmt = stmt.where(ChatMessage.id < before_id)
+        else:
+            stmt = stmt.offset(offset)
+
         messages = db.exec(stmt).all()
-        
-        return APIResponse.success_response(data=messages)
+
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        next_cursor = messages[-1].id if has_more else None
+
+        return APIResponse.success_response(data=messages, next_cursor=next_cursor)
     except Exception as e:
         logger.error(f"Failed to load chat history for {auth_id}: {str(e)}")
         raise AppException(
@@ -1,22 +1,82 @@
+import asyncio
+import json
+from contextlib import aclosing
+
 from fastapi import WebSocket, WebSocketDisconnect, APIRouter, HTTPException
-from sqlmodel import Session
+from pydantic import ValidationError
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.database.database import engine
+from app.database.database import async_engine
 from app.core.redis import redis_client
-from app.services.redis_service.redis_service import RedisChatService
+from app.services.redis_service.redis_service import RedisChatService, TERMINAL_REPLY_FRAMES, parse_frame_id
 from app.services.llm_service.llm_service import LLMService
+from app.services.llm_service.resilience import LLMUnavailableError
 from app.services.chat_service.chat_service import ChatService
+from app.services.chat_service.connection_hub import connection_hub
+from app.services.chat_service.reply_relay import ReplyRelay
 from app.core.dependencies import get_current_auth_id
 from app.core.security import jwt_handler
-from app.schema.chat_schema import WSChatMessage, WSErrorMessage
+from app.schema.chat_schema import WSChatMessage, WSChatDelta, WSChatDone, WSErrorMessage, WSClientFrame, WSResumed, WSAck
+from app.core.metrics import metrics
+from app.core.user_lock import user_turn_lock
+from app.core.settings import get_settings
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
+settings = get_settings()
 
 
 router = APIRouter()
 
 
+async def _collect_burst(
+    inbox: asyncio.Queue, first: WSClientFrame
+) -> tuple[list[WSClientFrame], bool]:
+    """
+    Coalesces rapid-fire messages into one turn: takes everything already queued
+    (sent while the previous reply was generating), then keeps waiting while new
+    messages arrive within the debounce window. Returns the message frames and
+    whether the client disconnected meanwhile.
+    """
+    frames = [first]
+    window = settings.CHAT_COALESCE_WINDOW_MS / 1000
+
+    while len(frames) < settings.CHAT_COALESCE_MAX_MESSAGES:
+        try:
+            if not inbox.empty():
+                frame = inbox.get_nowait()
+            elif window > 0:
+                frame = await asyncio.wait_for(inbox.get(), timeout=window)
+            else:
+                break
+        except asyncio.TimeoutError:
+            break
+        if frame is None:
+            return frames, True
+        frames.append(frame)
+
+    return frames, False
+
+
+def _parse_frame(raw: str) -> WSClientFrame | None:
+    """
+    JSON control/message frames; anything that isn't a JSON object is a plain-text
+    chat message. Returns None for a JSON object that isn't a valid frame, which
+    must never reach the LLM as text.
+    """
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        return WSClientFrame(type="message", content=raw)
+
+    try:
+        return WSClientFrame.model_validate(payload)
+    except ValidationError:
+        return None
+
+
 @router.websocket("/ws/chat")
 async def ws_chat_endpoint(websocket: WebSocket):
     # 🔐 Extract token safely
@@ -57,55 +117,315 @@ async def chat_websocket(websocket: WebSocket, auth_id: str, subprotocol: str =
 
     try:
         # 1. BOOTSTRAP: Open a temporary session to validate user and load context
-        with Session(engine) as db:
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
             chat_service = ChatService(
                 db=db,
                 redis_service=redis_service,
                 llm_service=llm_service
             )
 
-            if not chat_service.validate_user(auth_id):
+            # FIRST CONNECTION → load summary + last messages into Redis (for AI context).
+            # The same query validates the user; the id is reused for every message on this connection
+            user_id = await chat_service.bootstrap_context(auth_id)
+            if not user_id:
                 await websocket.close(code=1008)
                 return
-
-            # FIRST CONNECTION → load summary + last messages into Redis (for AI context)
-            await chat_service.bootstrap_context(auth_id)
             logger.info(f"User {auth_id} connected, bootstrapping context complete")
             
-        # 2. MESSAGE LOOP: Wait for messages and open a fresh session for each
-        while True:
-            user_text = await websocket.receive_text()
-
-            # Open a fresh session for THIS specific message exchange
-            with Session(engine) as db:
-                chat_service = ChatService(
-                    db=db,
-                    redis_service=redis_service,
-                    llm_service=llm_service
-                )
+        # Every frame of this conversation also goes to the user's other live connections
+        connection_id: str | None = None
+        try:
+            connection_id = await connection_hub.register(auth_id, websocket)
+            # Replay buffering and fan-out happen in the background, after the socket send
+            relay = ReplyRelay(redis_service, auth_id, origin=connection_id)
+            socket_open = True
 
+            async def send(frame: dict) -> None:
+                nonlocal socket_open
+                relay.stamp(frame)
+                if socket_open:
+                    try:
+                        await websocket.send_json(frame)
+                    except Exception as e:
+                        # Dropped mid-reply: keep generating, the client replays the buffer on resume
+                        logger.info(f"Socket for {auth_id} closed mid-reply: {e}")
+                        socket_open = False
+                # Errors are buffered for this client's resume but not shown on other devices
+                relay.push(frame, fanout=frame["type"] != "error")
+
+            async def resume(last_id: str | None) -> None:
+                """Replays the reply frames a reconnecting client missed after last_id."""
                 try:
-                    ai_reply = await chat_service.handle_message(
-                        auth_id=auth_id,
-                        user_text=user_text
-                    )
+                    ok, frames = False, []
+                    if settings.CHAT_RESUME_ENABLED and last_id:
+                        ok, frames = await redis_service.replay_reply_frames(auth_id, last_id)
+                    for frame in frames:
+                        await websocket.send_json(frame)
+                    await websocket.send_json(WSResumed(type="resumed", ok=ok).model_dump())
+                    metrics.incr("chat.resumes")
+                    metrics.incr("chat.resume.replayed_frames", len(frames))
+                    logger.info(f"Resumed {auth_id} from {last_id}: {len(frames)} frames replayed, ok={ok}")
+
+                    if not ok or settings.CHAT_FANOUT_ENABLED:
+                        # Later frames of a still-running reply arrive through the connection hub;
+                        # they may overlap the replay, so the client orders and dedupes by id
+                        return
+
+                    # 🔁 No fan-out: follow the buffer until the in-flight reply finishes
+                    reply_id, seq = parse_frame_id(frames[-1]["id"] if frames else last_id)
+                    finished = bool(frames) and frames[-1]["type"] in TERMINAL_REPLY_FRAMES
+                    while not finished:
+                        entries = await redis_service.get_reply_frames(auth_id, reply_id, seq)
+                        if not entries:
+                            if not await redis_service.is_reply_active(auth_id):
+                                return
+                            await asyncio.sleep(0.25)
+                            continue
+                        for frame in entries:
+                            await websocket.send_json(frame)
+                            seq = parse_frame_id(frame["id"])[1]
+                            finished = frame["type"] in TERMINAL_REPLY_FRAMES
+                except Exception as e:
+                    logger.error(f"Resume failed for {auth_id}: {e}")
+
+            # 2. MESSAGE LOOP: a reader task consumes the socket while replies generate,
+            # so a stop frame cancels the in-flight LLM call right away. A disconnect
+            # cancels it too, unless resume is enabled: then the reply finishes into the
+            # replay buffer and the client picks it up when it reconnects.
+            inbox: asyncio.Queue[WSClientFrame | None] = asyncio.Queue()
+            generation: asyncio.Task | None = None
+            resumer: asyncio.Task | None = None
+            stop_requested = False
 
+            # Retries of messages an earlier turn saved but never answered: answer, don't save
+            saved_ids: set[str] = set()
+
+            async def claim(client_msg_id: str) -> bool:
+                """
+                True for a first submission, or a retry of a saved but unanswered one.
+                Any other retry is dropped, and answered with the cached reply once
+                there is one (until then the reply is still on its way).
+                """
+                try:
+                    state, reply = await redis_service.claim_client_message(auth_id, client_msg_id)
+                except Exception as e:
+                    # Dedup is best-effort: the unique constraint still keeps the row single
+                    logger.warning(f"Client message dedup unavailable for {auth_id}: {e}")
+                    return True
+                if state == "saved":
+                    saved_ids.add(client_msg_id)
+                    return True
+                if state == "new":
+                    return True
+
+                metrics.incr("chat.duplicate_messages")
+                logger.info(f"Duplicate message {client_msg_id} from {auth_id}, not answering again")
+                if reply is not None:
                     await websocket.send_json(
-                        WSChatMessage(
-                            type="message",
-                            role="assistant",
-                            content=ai_reply
-                        ).model_dump()
+                        WSChatMessage(type="message", role="assistant", content=reply).model_dump()
                     )
+                return False
+
+            async def read_frames() -> None:
+                nonlocal stop_requested, socket_open, resumer
+                try:
+                    while True:
+                        frame = _parse_frame(await websocket.receive_text())
+                        if frame is None:
+                            logger.warning(f"Dropping malformed frame from {auth_id}")
+                            await websocket.send_json(
+                                WSErrorMessage(type="error", message="Unsupported or malformed frame.").model_dump()
+                            )
+                            continue
+                        if frame.type == "resume":
+                            if resumer is None or resumer.done():
+                                resumer = asyncio.create_task(resume(frame.last_id))
+                            continue
+                        if frame.type == "stop":
+                            if generation and not generation.done():
+                                logger.info(f"Stop requested by {auth_id}, cancelling reply")
+                                stop_requested = True
+                                generation.cancel()
+                            continue
+                        if frame.content and frame.content.strip():
+                            if frame.client_msg_id:
+                                is_new = await claim(frame.client_msg_id)
+                                await websocket.send_json(
+                                    WSAck(type="ack", client_msg_id=frame.client_msg_id).model_dump()
+                                )
+                                if not is_new:
+                                    continue
+                            await inbox.put(frame)
+                            if frame.client_msg_id not in saved_ids:
+                                # Show the message on the user's other devices
+                                relay.push(
+                                    WSChatMessage(type="message", role="user", content=frame.content).model_dump()
+                                )
+                except WebSocketDisconnect:
+                    logger.info(f"User {auth_id} disconnected")
                 except Exception as e:
-                    logger.error(f"Error processing message for {auth_id}: {e}")
-                    await websocket.send_json(
-                        WSErrorMessage(
-                            type="error",
-                            message="An error occurred while processing your message."
-                        ).model_dump()
+                    logger.error(f"WebSocket read error for {auth_id}: {e}")
+                finally:
+                    socket_open = False
+                    if generation and not generation.done():
+                        if settings.CHAT_RESUME_ENABLED:
+                            logger.info(f"Letting the reply for {auth_id} finish into the replay buffer")
+                        else:
+                            generation.cancel()
+                    inbox.put_nowait(None)
+
+            async def run_turn(
+                user_texts: list[str], client_msg_ids: list[str | None], already_saved: list[bool]
+            ) -> None:
+                # Open a fresh session for THIS specific message exchange
+                async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                    chat_service = ChatService(
+                        db=db,
+                        redis_service=redis_service,
+                        llm_service=llm_service
                     )
 
+                    try:
+                        if settings.CHAT_STREAMING_ENABLED:
+                            # Forward tokens as they arrive, then close the turn with the full reply
+                            chunks: list[str] = []
+                            try:
+                                async with aclosing(chat_service.stream_message(
+                                    auth_id=auth_id,
+                                    user_text=user_texts,
+                                    user_id=user_id,
+                                    client_msg_ids=client_msg_ids,
+                                    already_saved=already_saved,
+                                    on_turn_start=relay.begin_reply
+                                )) as deltas:
+                                    async for delta in deltas:
+                                        chunks.append(delta)
+                                        await send(
+                                            WSChatDelta(type="delta", content=delta).model_dump()
+                                        )
+                            except asyncio.CancelledError:
+                                # Close the turn on every device with whatever was streamed
+                                # (on disconnect only the other devices are left to tell)
+                                done = WSChatDone(
+                                    type="done",
+                                    role="assistant",
+                                    content="".join(chunks).strip(),
+                                    stopped=True
+                                ).model_dump()
+                                if stop_requested:
+                                    await send(done)
+                                else:
+                                    relay.push(relay.stamp(done))
+                                raise
+
+                            await send(
+                                WSChatDone(
+                                    type="done",
+                                    role="assistant",
+                                    content="".join(chunks).strip()
+                                ).model_dump()
+                            )
+                            return
+
+                        try:
+                            ai_reply = await chat_service.handle_message(
+                                auth_id=auth_id,
+                                user_text=user_texts,
+                                user_id=user_id,
+                                client_msg_ids=client_msg_ids,
+                                already_saved=already_saved,
+                                on_turn_start=relay.begin_reply
+                            )
+                        except asyncio.CancelledError:
+                            # Nothing was generated yet, but the client still needs the turn closed
+                            if stop_requested:
+                                await send(
+                                    WSChatDone(type="done", role="assistant", content="", stopped=True).model_dump()
+                                )
+                            raise
+
+                        await send(
+                            WSChatMessage(
+                                type="message",
+                                role="assistant",
+                                content=ai_reply
+                            ).model_dump()
+                        )
+                    except LLMUnavailableError as e:
+                        logger.error(f"LLM unavailable for {auth_id}: {e}")
+                        await send(
+                            WSErrorMessage(
+                                type="error",
+                                message="The assistant is taking too long to respond. Please try again."
+                            ).model_dump()
+                        )
+                    except Exception as e:
+                        logger.error(f"Error processing message for {auth_id}: {e}")
+                        await send(
+                            WSErrorMessage(
+                                type="error",
+                                message="An error occurred while processing your message."
+                            ).model_dump()
+                        )
+
+            reader = asyncio.create_task(read_frames())
+            try:
+                while True:
+                    first = await inbox.get()
+                    if first is None:
+                        break
+
+                    # Messages sent while the last reply generated, or within the debounce window,
+                    # are saved individually but answered with one LLM turn
+                    frames, disconnected = await _collect_burst(inbox, first)
+                    user_texts = [frame.content for frame in frames]
+                    client_msg_ids = [frame.client_msg_id for frame in frames]
+                    already_saved = [i in saved_ids for i in client_msg_ids]
+                    saved_ids.difference_update(i for i in client_msg_ids if i)
+                    if len(user_texts) > 1:
+                        metrics.incr("chat.messages_coalesced", len(user_texts) - 1)
+                        logger.info(f"Coalesced {len(user_texts)} messages from {auth_id} into one turn")
+
+                    if disconnected:
+                        # Nobody is left to read a reply: keep the messages, skip the LLM call
+                        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                            chat_service = ChatService(db=db, redis_service=redis_service, llm_service=llm_service)
+                            claimed = [i for i in client_msg_ids if i]
+                            try:
+                                async with user_turn_lock.hold(auth_id):
+                                    await chat_service.save_user_messages(
+                                        auth_id, user_id, user_texts, client_msg_ids, already_saved
+                                    )
+                            except BaseException:
+                                # Not saved: the client's retry is processed from scratch
+                                await asyncio.shield(redis_service.release_client_messages(auth_id, claimed))
+                                raise
+                        # Saved but unanswered: the client's retry after reconnecting gets a reply, not a second save
+                        await redis_service.mark_client_messages_saved(auth_id, claimed)
+                        break
+
+                    stop_requested = False
+                    # The relay begins the reply once the turn lock is held (inside the turn);
+                    # best-effort like the frames, a Redis error can't end the loop
+                    generation = asyncio.create_task(run_turn(user_texts, client_msg_ids, already_saved))
+                    # wait() doesn't raise when the turn is cancelled by stop/disconnect
+                    await asyncio.wait({generation})
+                    relay.end_reply()
+                    if generation.cancelled():
+                        metrics.incr("chat.replies_cancelled")
+                    elif generation.exception():
+                        logger.error(f"Reply failed for {auth_id}: {generation.exception()}")
+            finally:
+                reader.cancel()
+                if resumer and not resumer.done():
+                    resumer.cancel()
+                if generation and not generation.done():
+                    generation.cancel()
+                await relay.close()
+        finally:
+            if connection_id is not None:
+                await connection_hub.unregister(auth_id, connection_id)
+
     except WebSocketDisconnect:
         logger.info(f"User {auth_id} disconnected")
     except Exception as e:
@@ -0,0 +1,32 @@
+# app/core/llm_client.py
+import httpx
+from openai import AsyncOpenAI
+from app.core.settings import get_settings
+settings = get_settings()
+
+# One HTTP pool per process, shared by chat replies and summarization,
+# so OpenRouter connections (and their TLS sessions) are reused across requests.
+llm_http_client = httpx.AsyncClient(
+    http2=settings.LLM_HTTP2,
+    limits=httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    ),
+    timeout=httpx.Timeout(
+        connect=settings.LLM_CONNECT_TIMEOUT,
+        read=settings.LLM_READ_TIMEOUT,
+        write=settings.LLM_WRITE_TIMEOUT,
+        pool=settings.LLM_POOL_TIMEOUT,
+    ),
+)
+llm_client = AsyncOpenAI(
+    base_url=settings.OPENROUTER_BASE_URL,
+    api_key=settings.OPENROUTER_API_KEY,
+    http_client=llm_http_client,
+    max_retries=settings.LLM_MAX_RETRIES,
+)
+
+
+async def close_llm_client():
+    await llm_client.close()
@@ -0,0 +1,65 @@
+# app/core/metrics.py
+import threading
+from collections import defaultdict, deque
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry: counters, gauges and latency timings.
+    Timings keep a bounded window of recent samples for percentile reporting.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._counters: dict[str, int] = defaultdict(int)
+        self._gauges: dict[str, float] = {}
+        self._timings: dict[str, deque] = defaultdict(lambda: deque(maxlen=self.window))
+        self._timing_counts: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._timings[name].append(seconds * 1000)
+            self._timing_counts[name] += 1
+
+    def percentile(self, name: str, pct: float) -> float | None:
+        """Percentile (in ms) over the recent window, or None when there are no samples."""
+        with self._lock:
+            samples = sorted(self._timings.get(name) or ())
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {name: sorted(samples) for name, samples in self._timings.items()}
+            snapshot = {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings_ms": {},
+            }
+            counts = dict(self._timing_counts)
+
+        for name, samples in timings.items():
+            if not samples:
+                continue
+            snapshot["timings_ms"][name] = {
+                "count": counts[name],
+                "avg": round(sum(samples) / len(samples), 2),
+                "p50": round(samples[len(samples) // 2], 2),
+                "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+                "max": round(samples[-1], 2),
+            }
+        return snapshot
+
+
+metrics = Metrics()
@@ -1,9 +1,23 @@
 # app/core/redis.py
-import redis
+import redis.asyncio as redis
 from app.core.settings import get_settings
 settings = get_settings()
-redis_client = redis.Redis(
+
+# One pool per process, shared by every RedisChatService instance.
+# BlockingConnectionPool waits (up to REDIS_POOL_TIMEOUT) for a free connection instead of failing fast.
+redis_pool = redis.BlockingConnectionPool(
     host=settings.REDIS_HOST,
     port=settings.REDIS_PORT,
-    decode_responses=settings.REDIS_DECODE_RESPONSES
+    decode_responses=settings.REDIS_DECODE_RESPONSES,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
 )
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+
+async def close_redis():
+    await redis_client.aclose()
+    await redis_pool.disconnect()
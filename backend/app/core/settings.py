@@ -22,6 +22,85 @@ class Settings(BaseSettings):
         "extra": "ignore",
     }
     REDIS_DECODE_RESPONSES: bool = True
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 5.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    CHAT_STREAMING_ENABLED: bool = True
+    CHAT_COALESCE_WINDOW_MS: int = 300  # debounce for rapid-fire messages; 0 only merges messages queued during a reply
+    CHAT_COALESCE_MAX_MESSAGES: int = 10
+    CHAT_FANOUT_ENABLED: bool = True  # mirror frames to the user's other connections via Redis pub/sub
+    CHAT_FANOUT_QUEUE_SIZE: int = 256  # frames queued per connection before a slow client is dropped
+    CHAT_FANOUT_SEND_TIMEOUT: float = 5.0
+    CHAT_TURN_LOCK_TIMEOUT: float | None = None  # unset: derived, see turn_lock_timeout
+    CHAT_TURN_LEASE_ENABLED: bool = False  # Redis lease for multi-node deployments
+    CHAT_TURN_LEASE_MS: int = 30000  # renewed while held
+    CHAT_RESUME_ENABLED: bool = True  # buffer reply frames so a reconnecting client can replay them
+    CHAT_REPLY_BUFFER_TTL: int = 300  # seconds
+    CHAT_REPLY_BUFFER_REPLIES: int = 5  # most recent replies kept per user
+    CHAT_CLIENT_MSG_DEDUP_TTL: int = 3600  # seconds a client_msg_id (and its reply) is remembered
+    USER_ID_CACHE_SIZE: int = 10000
+    USER_ID_CACHE_TTL: int = 300
+    MESSAGE_WRITER_BATCH_SIZE: int = 100
+    MESSAGE_WRITER_FLUSH_INTERVAL_MS: int = 50
+    MESSAGE_WRITER_QUEUE_SIZE: int = 10000
+    MESSAGE_WRITER_MAX_RETRIES: int = 5  # transient failures per batch before it is dead-lettered
+    MESSAGE_WRITER_ENQUEUE_TIMEOUT: float = 5.0  # seconds a chat turn may wait on a full queue
+    MESSAGE_WRITER_DEAD_LETTER_KEY: str = "chat:messages:dead"
+    SUMMARY_WORKER_CONCURRENCY: int = 2
+    SUMMARY_QUEUE_SIZE: int = 1000
+    SUMMARY_QUEUE_BACKEND: str = "local"  # "local" (in-process pool) or "stream" (app.workers.summarizer)
+    SUMMARY_STREAM_KEY: str = "summary:jobs"
+    SUMMARY_STREAM_GROUP: str = "summarizers"
+    SUMMARY_DEAD_LETTER_KEY: str = "summary:jobs:dead"
+    SUMMARY_STREAM_MAXLEN: int = 100000
+    SUMMARY_MAX_ATTEMPTS: int = 5
+    SUMMARY_CLAIM_IDLE_MS: int = 60000
+    LLM_HTTP2: bool = True
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY: float = 60.0
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_READ_TIMEOUT: float = 60.0
+    LLM_WRITE_TIMEOUT: float = 10.0
+    LLM_POOL_TIMEOUT: float = 5.0
+    LLM_MAX_RETRIES: int = 0  # retries are owned by the resilience layer (hedging + fallback)
+    LLM_ATTEMPT_TIMEOUT: float = 20.0  # per attempt: full reply, or first token when streaming
+    LLM_TOTAL_TIMEOUT: float = 45.0  # all attempts, hedges and fallbacks together
+    LLM_STREAM_TIMEOUT: float = 120.0  # whole streamed reply
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_PERCENTILE: float = 95.0
+    LLM_HEDGE_MIN_DELAY: float = 1.0
+    LLM_HEDGE_MAX_DELAY: float = 10.0
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5
+    LLM_BREAKER_RESET_SECONDS: float = 30.0
+    OPENROUTER_FALLBACK_MODEL: str | None = None
+    LLM_MAX_CONCURRENCY: int = 32  # per process
+    LLM_BACKGROUND_MAX_CONCURRENCY: int = 4  # slots summaries may hold per process
+    LLM_ADMISSION_TIMEOUT: float = 10.0  # max queue wait for interactive replies
+    LLM_CLUSTER_MAX_CONCURRENCY: int = 0  # 0 disables the Redis-coordinated cap
+    LLM_CLUSTER_INTERACTIVE_RESERVE: int = 8  # cluster slots background work can't take
+    LLM_CLUSTER_LEASE_MS: int = 180000
+    LLM_PROMPT_CACHE_CONTROL: bool = False  # cache_control hints on system segments (Anthropic/Gemini models)
+    LLM_RESPONSE_CACHE_ENABLED: bool = False
+    LLM_RESPONSE_CACHE_TTL: int = 86400
+    LLM_RESPONSE_CACHE_MAX_ENTRIES: int = 10000
+    PROMPT_TOKENIZER_ENCODING: str = "o200k_base"
+    PROMPT_SUMMARY_TOKEN_BUDGET: int = 400
+    PROMPT_PROFILE_TOKEN_BUDGET: int = 300
+    PROMPT_HISTORY_TOKEN_BUDGET: int = 2000
+    PROMPT_INPUT_TOKEN_BUDGET: int = 2000
+
+    @property
+    def turn_lock_timeout(self) -> float:
+        """
+        How long a turn waits for the user's previous one. By default that turn's
+        worst case: the admission wait, the longest LLM deadline, plus a margin for saves.
+        """
+        if self.CHAT_TURN_LOCK_TIMEOUT is not None:
+            return self.CHAT_TURN_LOCK_TIMEOUT
+        return self.LLM_ADMISSION_TIMEOUT + max(self.LLM_TOTAL_TIMEOUT, self.LLM_STREAM_TIMEOUT) + 10
 
 
 _settings: Settings | None = None
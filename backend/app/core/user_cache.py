@@ -0,0 +1,55 @@
+# app/core/user_cache.py
+import threading
+import time
+from collections import OrderedDict
+from uuid import UUID
+
+from app.core.settings import get_settings
+
+settings = get_settings()
+
+
+class UserIdCache:
+    """
+    Process-local LRU cache of auth_id -> UserOnboarding.id with a TTL.
+    Thread-safe, since sync REST endpoints run in FastAPI's threadpool.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[UUID, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, auth_id) -> UUID | None:
+        key = str(auth_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            user_id, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return user_id
+
+    def set(self, auth_id, user_id: UUID) -> None:
+        key = str(auth_id)
+        with self._lock:
+            self._entries[key] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, auth_id) -> None:
+        with self._lock:
+            self._entries.pop(str(auth_id), None)
+
+
+user_id_cache = UserIdCache(
+    maxsize=settings.USER_ID_CACHE_SIZE,
+    ttl=settings.USER_ID_CACHE_TTL,
+)
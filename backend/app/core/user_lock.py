@@ -0,0 +1,138 @@
+# app/core/user_lock.py
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from app.core.redis import redis_client
+from app.core.settings import get_settings
+from app.core.metrics import metrics
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+# Delete / extend the lease only while we still own it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class UserTurnLock:
+    """
+    Serializes chat exchanges per user without blocking other users.
+    In-process: one asyncio.Lock per auth_id (FIFO for waiters on this node),
+    dropped once nobody holds or waits on it.
+    Multi-node (lease_enabled): additionally holds a Redis lease on
+    chat:{auth_id}:turn_lock, renewed while held so a crashed node frees it after lease_ms.
+    """
+
+    def __init__(
+        self,
+        lease_enabled: bool = settings.CHAT_TURN_LEASE_ENABLED,
+        lease_ms: int = settings.CHAT_TURN_LEASE_MS,
+        timeout: float = settings.turn_lock_timeout,
+    ):
+        self.client = redis_client
+        self.lease_enabled = lease_enabled
+        self.lease_ms = lease_ms
+        self.timeout = timeout
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+        self._release = self.client.register_script(RELEASE_SCRIPT)
+        self._renew = self.client.register_script(RENEW_SCRIPT)
+
+    def _lease_key(self, auth_id: str) -> str:
+        return f"chat:{auth_id}:turn_lock"
+
+    def _checkout(self, key: str) -> asyncio.Lock:
+        lock, refs = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, refs + 1)
+        return lock
+
+    def _checkin(self, key: str) -> None:
+        lock, refs = self._locks[key]
+        if refs <= 1:
+            del self._locks[key]
+        else:
+            self._locks[key] = (lock, refs - 1)
+
+    async def _acquire_lease(self, auth_id: str, token: str) -> None:
+        key = self._lease_key(auth_id)
+        if await self.client.set(key, token, nx=True, px=self.lease_ms):
+            return
+        # Another node is running this user's turn
+        metrics.incr("chat.turn_lock.contended")
+        while not await self.client.set(key, token, nx=True, px=self.lease_ms):
+            await asyncio.sleep(0.05)
+
+    async def _keep_lease(self, auth_id: str, token: str) -> None:
+        key = self._lease_key(auth_id)
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            if not await self._renew(keys=[key], args=[token, self.lease_ms]):
+                logger.warning(f"Turn lease for {auth_id} was lost")
+                return
+
+    @asynccontextmanager
+    async def hold(self, auth_id: str) -> AsyncIterator[None]:
+        """
+        Holds the user's turn for the duration of the block.
+        Raises TimeoutError if it can't be acquired within timeout seconds.
+        """
+        key = str(auth_id)
+        started = time.perf_counter()
+        lock = self._checkout(key)
+        try:
+            if not lock.locked():
+                # Uncontended: acquires without yielding
+                await lock.acquire()
+            else:
+                metrics.incr("chat.turn_lock.contended")
+                try:
+                    await asyncio.wait_for(lock.acquire(), self.timeout)
+                except asyncio.TimeoutError:
+                    metrics.incr("chat.turn_lock.timeouts")
+                    raise
+
+            try:
+                token = None
+                renewer = None
+                if self.lease_enabled:
+                    token = uuid.uuid4().hex
+                    remaining = max(self.timeout - (time.perf_counter() - started), 0)
+                    try:
+                        await asyncio.wait_for(self._acquire_lease(key, token), remaining)
+                    except asyncio.TimeoutError:
+                        metrics.incr("chat.turn_lock.timeouts")
+                        raise
+                    renewer = asyncio.create_task(self._keep_lease(key, token))
+
+                metrics.observe("chat.turn_lock.wait", time.perf_counter() - started)
+                try:
+                    yield
+                finally:
+                    if renewer:
+                        renewer.cancel()
+                        try:
+                            await self._release(keys=[self._lease_key(key)], args=[token])
+                        except Exception as e:
+                            logger.warning(f"Failed to release turn lease for {auth_id}: {e}")
+            finally:
+                lock.release()
+        finally:
+            self._checkin(key)
+
+
+user_turn_lock = UserTurnLock()
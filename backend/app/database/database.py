@@ -1,11 +1,30 @@
 from sqlmodel import SQLModel, Session, create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from app.core.settings import get_settings
 
 settings = get_settings()
 
+# Sync engine: REST endpoints and Alembic migrations
 engine = create_engine(
     settings.DATABASE_URL,
     echo=True,
     pool_pre_ping=True,
 )
 
+
+def _async_database_url(url: str) -> str:
+    """
+    Maps DATABASE_URL (postgresql:// or postgresql+psycopg2://) onto the asyncpg driver.
+    """
+    scheme, _, rest = url.partition("://")
+    if scheme.split("+")[0] in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+
+# Async engine: WebSocket chat path, so DB round-trips don't block the event loop
+async_engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    echo=settings.DEBUG,
+    pool_pre_ping=True,
+)
@@ -10,7 +10,14 @@ logger = get_logger(__name__)
 
 from app.apis.v1 import auth,user
 from app.apis.v1 import ws_chat, chat_history
-from app.database.database import engine
+from app.database.database import engine, async_engine
+from app.core.redis import close_redis
+from app.core.llm_client import close_llm_client
+from app.services.chat_service.message_writer import message_writer
+from app.services.chat_service.connection_hub import connection_hub
+from app.services.memory_service.summary_scheduler import summary_scheduler
+from app.services.llm_service.prompt_builder import count_tokens
+from app.core.metrics import metrics
 from sqlmodel import SQLModel
 from sqlmodel import  text
 from fastapi.exceptions import RequestValidationError
@@ -65,6 +72,10 @@ def on_startup():
 def health_check():
     return APIResponse.success_response(data={"status": "ok"})
 
+@app.get("/health/metrics", tags=["Health"], response_model=APIResponse[dict])
+def metrics_snapshot():
+    return APIResponse.success_response(data=metrics.snapshot())
+
 @app.on_event("startup")
 def startup_db_check():
     try:
@@ -73,4 +84,26 @@ def startup_db_check():
         logger.info("✅ Database connected successfully")
     except Exception as e:
         logger.error("❌ Database connection failed")
-        raise e
\ No newline at end of file
+        raise e
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    # Load the tokenizer up front so the first chat turn doesn't pay for it
+    count_tokens("warmup")
+    message_writer.start()
+    if settings.CHAT_FANOUT_ENABLED:
+        connection_hub.start()
+    if settings.SUMMARY_QUEUE_BACKEND == "local":
+        summary_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Flush pending chat messages before the engine goes away
+    await message_writer.stop()
+    await connection_hub.stop()
+    await summary_scheduler.stop()
+    await async_engine.dispose()
+    await close_redis()
+    await close_llm_client()
@@ -1,5 +1,6 @@
 # app/models/chat_model.py
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, UniqueConstraint
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
@@ -8,6 +9,13 @@ import uuid
 
 class ChatMessage(SQLModel, table=True):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Serves per-user scans on id in either direction: newest-first history pages
+        # (keyset on before_id), the recent window and the unsummarized count
+        Index("ix_chat_messages_user_id_id", "user_id", "id"),
+        # A retried submission (same client-generated id) is stored once
+        UniqueConstraint("user_id", "client_msg_id", name="uq_chat_messages_user_id_client_msg_id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
@@ -18,6 +26,7 @@ class ChatMessage(SQLModel, table=True):
     )
     role: str = Field(nullable=False)
     message: str
+    client_msg_id: Optional[str] = Field(default=None, max_length=64)
     created_at: datetime = Field(default_factory=datetime.utcnow,index=True)
 
     user: Optional["UserOnboarding"] = Relationship(back_populates="chat_messages")
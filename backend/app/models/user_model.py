@@ -1,6 +1,7 @@
 # app/models/user_model.py
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
+from datetime import datetime
 from uuid import UUID
 from sqlalchemy import Column
 from sqlalchemy.dialects.postgresql import JSONB
@@ -32,6 +33,7 @@ class UserOnboarding(SQLModel, table=True):
 
     additional_notes: Optional[str] = None
     onboarding_completed: bool = Field(default=False)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     # 1 → many
     chat_messages: List["ChatMessage"] = Relationship(back_populates="user")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Literal
 from datetime import datetime
 
@@ -18,6 +18,13 @@ class ChatContextMessage(BaseModel):
     role: str
     content: str 
 
+class ChatContext(BaseModel):
+    """Prompt context read from Redis in one round-trip"""
+    messages: List[dict]
+    summary: str
+    user_context: Optional[str] = None
+    count: int
+
 class WSMessage(BaseModel):
     type: str
     data: Optional[dict] = None
@@ -27,11 +34,45 @@ class WSInfoMessage(BaseModel):
     type: Literal["history"]
     messages: List[ChatContextMessage]
 
+# Reply frames carry the id of their replay buffer entry (None when resume is off)
 class WSChatMessage(BaseModel):
     type: Literal["message"]
     role: str
     content: str
+    id: Optional[str] = None
+
+class WSChatDelta(BaseModel):
+    type: Literal["delta"]
+    content: str
+    id: Optional[str] = None
+
+class WSChatDone(BaseModel):
+    type: Literal["done"]
+    role: str
+    content: str
+    stopped: bool = False
+    id: Optional[str] = None
+
+# Sent after replaying missed frames; ok=False means the buffer no longer
+# reaches back to last_id and the client should reload history
+class WSResumed(BaseModel):
+    type: Literal["resumed"]
+    ok: bool
+
+# Confirms the server has a client_msg_id: the client stops retrying it
+class WSAck(BaseModel):
+    type: Literal["ack"]
+    client_msg_id: str
+
+# Client -> server frames (plain text frames are still accepted as messages)
+class WSClientFrame(BaseModel):
+    type: Literal["message", "stop", "resume"]
+    content: Optional[str] = None
+    last_id: Optional[str] = None
+    # Client-generated id: a retried message with the same id is answered once
+    client_msg_id: Optional[str] = Field(default=None, max_length=64)
 
 class WSErrorMessage(BaseModel):
     type: Literal["error"]
     message: str
+    id: Optional[str] = None
@@ -12,10 +12,11 @@ class APIResponse(BaseModel, Generic[T]):
     message: str
     data: Optional[T] = None
     error: Optional[APIError] = None
+    next_cursor: Optional[int] = None
 
     @classmethod
-    def success_response(cls, data: T = None, message: str = "Success"):
-        return cls(success=True, message=message, data=data, error=None)
+    def success_response(cls, data: T = None, message: str = "Success", next_cursor: Optional[int] = None):
+        return cls(success=True, message=message, data=data, error=None, next_cursor=next_cursor)
 
     @classmethod
     def error_response(cls, code: str, message: str):
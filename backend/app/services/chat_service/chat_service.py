@@ -1,141 +1,299 @@
-from sqlmodel import Session, select
-import threading
+import asyncio
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Callable, List
+from uuid import UUID
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.models.chat_models import ChatMessage, UserSummary
 from app.models.user_model import UserOnboarding
 from app.services.redis_service.redis_service import RedisChatService
 from app.services.llm_service.llm_service import LLMService
+from app.services.llm_service.prompt_builder import count_tokens
 from app.utility.role_enum import ChatRole
 from app.services.memory_service.memory_service import MemoryService
+from app.services.memory_service.summary_scheduler import summary_scheduler
+from app.services.chat_service.message_writer import message_writer
 from app.core.settings import get_settings
+from app.core.user_cache import user_id_cache
+from app.core.user_lock import user_turn_lock
+from app.schema.chat_schema import ChatContext
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
 settings = get_settings()
 
+class UserTurn:
+    """One locked exchange: the saved messages' prompt context and their claimed client ids."""
+
+    def __init__(self, user_id: UUID, user_input: str, context: ChatContext, claimed: List[str]):
+        self.user_id = user_id
+        self.user_input = user_input
+        self.context = context
+        self.claimed = claimed
+        self.answered = False
+
+
 class ChatService:
-    def __init__(self, db: Session, redis_service: RedisChatService, llm_service: LLMService):
+    def __init__(self, db: AsyncSession, redis_service: RedisChatService, llm_service: LLMService):
         self.db = db
         self.redis = redis_service
         self.llm = llm_service
         self.memory = MemoryService(db, redis_service)
 
-    def get_user(self, auth_id: str) -> UserOnboarding | None:
+    async def get_user(self, auth_id: str) -> UserOnboarding | None:
         stmt = select(UserOnboarding).where(
             UserOnboarding.auth_user_id == auth_id
         )
-        return self.db.exec(stmt).first()
+        return (await self.db.exec(stmt)).first()
+
+    async def get_user_id(self, auth_id: str) -> UUID | None:
+        """
+        Resolves auth_id -> UserOnboarding.id, served from the process-local cache when possible.
+        """
+        user_id = user_id_cache.get(auth_id)
+        if user_id is not None:
+            return user_id
+
+        user = await self.get_user(auth_id)
+        if not user:
+            return None
+
+        user_id_cache.set(auth_id, user.id)
+        return user.id
 
-    def validate_user(self, auth_id: str) -> bool:
-        return self.get_user(auth_id) is not None
+    async def validate_user(self, auth_id: str) -> bool:
+        return await self.get_user_id(auth_id) is not None
 
-    async def bootstrap_context(self, auth_id: str, limit: int = None) -> None:
+    async def bootstrap_context(self, auth_id: str, limit: int = None) -> UUID | None:
         """
         Initializes the chat session in Redis. 
         Clears old cache to prevent duplicates and loads fresh context from DB.
+        Returns early when the cached session is already at the current version stamp.
+        Returns the user's id, or None when the user doesn't exist (the version
+        query doubles as validation, so no separate lookup is needed).
         """
         if limit is None:
             limit = settings.CHAT_CACHE_LIMIT
 
-        user = self.get_user(auth_id)
-        if not user:
-            return
-
-        user_id = user.id
+        # Warm reconnect: a cheap version query + one Redis round-trip, skip the reload when nothing changed
+        current = await self.memory.load_session_version(auth_id)
+        if not current:
+            return None
+        user_id_cache.set(auth_id, current.user_id)
+        if await self.redis.is_session_current(auth_id, current.version()):
+            logger.info(f"Session for {auth_id} is current, skipping bootstrap reload")
+            return current.user_id
 
-        # 1️⃣ Clear old chat cache to prevent duplicates on reconnect
-        self.redis.clear_messages(auth_id)
+        # 0️⃣ One query for profile, summary, recent window, unsummarized count and the version stamp
+        snapshot = await self.memory.load_session_snapshot(auth_id, limit)
+        if not snapshot:
+            return None
+        version = snapshot.version()
 
-        # 2️⃣ Load recent messages into Redis for prompt context
-        stmt = (
-            select(ChatMessage)
-            .where(ChatMessage.user_id == user_id)
-            .order_by(ChatMessage.id.desc())
-            .limit(settings.CHAT_CACHE_LIMIT)
+        # 1️⃣ Swap the recent window into Redis in one round-trip (replaces the old cache, so no duplicates on reconnect)
+        await self.redis.replace_messages(
+            auth_id,
+            [
+                {"role": msg["role"], "content": msg["content"], "tokens": count_tokens(msg["content"])}
+                for msg in snapshot.recent_messages
+            ],
+            limit=limit,
         )
 
-        messages = list(reversed(self.db.exec(stmt).all()))
-        for msg in messages:
-            self.redis.push_message(
-                auth_id,
-                role=msg.role,
-                content=msg.message,
-                limit=settings.CHAT_CACHE_LIMIT
-            )
+        # 2️⃣ Sync Summary
+        await self.redis.set_summary(auth_id, long_summary=snapshot.long_summary)
 
-        # 3️⃣ Sync Summary
-        get_long_term_summary = self.memory.get_long_term_summary(user_id)
-        self.redis.set_summary(
-            auth_id,
-            long_summary=get_long_term_summary.long_summary if get_long_term_summary else "",
+        # 3️⃣ Initialize count & User Context
+        await self.memory.initialize_message_count(
+            auth_id=auth_id, user_id=snapshot.user_id, count=snapshot.unsummarized_count
+        )
+        await self.memory.load_user_context(
+            auth_id=auth_id, user_id=snapshot.user_id, onboarding=snapshot.profile
         )
 
-        # 4️⃣ Initialize count & User Context
-        self.memory.initialize_message_count(auth_id=auth_id, user_id=user_id)
-        self.memory.load_user_context(auth_id=auth_id, user_id=user_id)
+        # 4️⃣ Stamp the freshly loaded session
+        await self.redis.set_session_version(auth_id, version)
+        return snapshot.user_id
 
-    async def handle_message(self, auth_id: str, user_text: str) -> str:
+    async def save_user_messages(
+        self,
+        auth_id: str,
+        user_id,
+        user_texts: List[str],
+        client_msg_ids: List[str | None] | None = None,
+        already_saved: List[bool] | None = None,
+    ) -> ChatContext:
         """
-        Handle incoming user message, generate AI reply, and trigger summary update if needed.
+        Persists each user message individually and returns the prompt context
+        from before them (a coalesced burst is answered as one turn).
+        client_msg_ids and already_saved, when given, line up with user_texts;
+        messages saved by an earlier, unanswered turn are not saved again.
         """
-        user = self.get_user(auth_id)
-        if not user:
-            raise ValueError("Invalid user")
-
-        user_id = user.id
+        client_msg_ids = client_msg_ids or [None] * len(user_texts)
+        already_saved = already_saved or [False] * len(user_texts)
+        new_texts = [text for text, saved in zip(user_texts, already_saved) if not saved]
 
-        # Save user message
-        self.db.add(
-            ChatMessage(
-                user_id=user_id,
-                role=ChatRole.USER.value,
-                message=user_text,
-            )
-        )
-        self.db.commit()
+        # Save user messages (write-behind: flushed to Postgres in the background)
+        for user_text, client_msg_id, saved in zip(user_texts, client_msg_ids, already_saved):
+            if not saved:
+                await message_writer.enqueue(
+                    user_id, ChatRole.USER.value, user_text, auth_id=auth_id, client_msg_id=client_msg_id
+                )
 
-        self.redis.push_message(
+        # One Redis round-trip: push + count + read the prompt context
+        context = await self.redis.push_and_fetch_context(
             auth_id,
             role=ChatRole.USER.value,
-            content=user_text,
+            contents=new_texts,
             limit=settings.CHAT_CACHE_LIMIT,
-        )
-        self.memory.increment_message_count(auth_id)
-        #TODO : we need to make sure that if we fallback from redis we use postgres as of now we are assuming data availabe in redis
-        ai_reply = await self.llm.generate_reply(
-            summary=self.redis.get_summary(auth_id),
-            messages=self.redis.get_messages(auth_id),
-            user_input=user_text,
-            user_info=self.redis.get_user_context(auth_id),
+            tokens=[count_tokens(user_text) for user_text in new_texts],
         )
 
-        # Save AI message
-        self.db.add(
-            ChatMessage(
-                user_id=user_id,
-                role=ChatRole.ASSISTANT.value,
-                message=ai_reply,
-            )
-        )
-        self.db.commit()
+        # Earlier saved messages end the cached window: drop them, they are part of user_input
+        for user_text in reversed([t for t, saved in zip(user_texts, already_saved) if saved]):
+            last = context.messages[-1] if context.messages else {}
+            if last.get("role") == ChatRole.USER.value and last.get("content") == user_text:
+                context.messages.pop()
+        return context
 
-        self.redis.push_message(
+    async def _save_assistant_message(self, auth_id: str, turn: UserTurn, ai_reply: str) -> None:
+        # Save AI message (write-behind: flushed to Postgres in the background)
+        await message_writer.enqueue(turn.user_id, ChatRole.ASSISTANT.value, ai_reply, auth_id=auth_id)
+
+        # Retries of the messages this answers get the same reply, not a new LLM call
+        # (an empty reply is no answer: the claims end up saved-but-unanswered instead)
+        if ai_reply:
+            turn.answered = True
+            await self.redis.complete_client_messages(auth_id, turn.claimed, ai_reply)
+
+        count = await self.redis.push_and_count(
             auth_id,
             role=ChatRole.ASSISTANT.value,
             content=ai_reply,
             limit=settings.CHAT_CACHE_LIMIT,
+            tokens=count_tokens(ai_reply),
         )
-        self.memory.increment_message_count(auth_id)
-
-        #TODO : Use threading instead of BackgroundTasks (which doesn't work with WebSocket) but we can face issue in  threading in scale so we need to implement using asyncio.to_thread
-        if self.memory.should_update_summary(auth_id):
-            logger.info(f"Triggering summary update in background thread for {auth_id}")
-            thread = threading.Thread(
-                target=self.memory.update_summary_with_llm,
-                args=(auth_id, user_id),
-                daemon=True  # Daemon thread won't prevent app shutdown
+
+        # BackgroundTasks don't work with WebSocket, so the summary goes to the bounded summary worker pool
+        # or, with SUMMARY_QUEUE_BACKEND=stream, to the out-of-process summarizer
+        if await self.memory.should_update_summary(auth_id, count=count):
+            logger.info(f"Queueing summary update for {auth_id}")
+            if settings.SUMMARY_QUEUE_BACKEND == "stream":
+                await self.redis.enqueue_summary_job(auth_id, turn.user_id)
+            else:
+                await summary_scheduler.submit(auth_id, turn.user_id)
+
+    @asynccontextmanager
+    async def _user_turn(
+        self,
+        auth_id: str,
+        user_text: str | List[str],
+        user_id: UUID | None,
+        client_msg_ids: List[str | None] | None,
+        already_saved: List[bool] | None,
+        on_turn_start: Callable[[], None] | None,
+    ) -> AsyncIterator[UserTurn]:
+        """
+        Holds the user's turn and saves the messages for the block.
+        on_turn_start runs once the turn lock is held.
+        Claimed messages are released if they never got saved (lock timeout,
+        stop while queued, Redis error), and marked saved but unanswered if the
+        block ends without an answer.
+        """
+        user_texts = [user_text] if isinstance(user_text, str) else list(user_text)
+        claimed = [i for i in client_msg_ids or [] if i]
+        turn: UserTurn | None = None
+        try:
+            if user_id is None:
+                user_id = await self.get_user_id(auth_id)
+            if not user_id:
+                raise ValueError("Invalid user")
+
+            # One exchange per user at a time (other tabs / nodes queue behind it)
+            async with user_turn_lock.hold(auth_id):
+                if on_turn_start is not None:
+                    on_turn_start()
+                context = await self.save_user_messages(
+                    auth_id, user_id, user_texts, client_msg_ids, already_saved
+                )
+                turn = UserTurn(user_id, "\n".join(user_texts), context, claimed)
+                try:
+                    yield turn
+                finally:
+                    if not turn.answered:
+                        # Saved but unanswered: a retry of these messages gets a reply, not a second save
+                        await asyncio.shield(self.redis.mark_client_messages_saved(auth_id, claimed))
+        except BaseException:
+            if turn is None:
+                # Not saved: a retry of these messages is processed from scratch
+                await asyncio.shield(self.redis.release_client_messages(auth_id, claimed))
+            raise
+
+    async def handle_message(
+        self,
+        auth_id: str,
+        user_text: str | List[str],
+        user_id: UUID | None = None,
+        client_msg_ids: List[str | None] | None = None,
+        already_saved: List[bool] | None = None,
+        on_turn_start: Callable[[], None] | None = None,
+    ) -> str:
+        """
+        Handle incoming user message, generate AI reply, and trigger summary update if needed.
+        Pass user_id when the caller already resolved it (e.g. once per WebSocket connection).
+        Pass a list of texts to answer a burst of messages with a single reply.
+        Pass the messages' client_msg_ids (claimed by the caller) to cache the reply for retries,
+        and already_saved to answer messages an earlier turn saved without answering.
+        on_turn_start is called once this user's turn lock is held (earlier turns have finished).
+        """
+        async with self._user_turn(
+            auth_id, user_text, user_id, client_msg_ids, already_saved, on_turn_start
+        ) as turn:
+            #TODO : we need to make sure that if we fallback from redis we use postgres as of now we are assuming data availabe in redis
+            ai_reply = await self.llm.generate_reply(
+                summary=turn.context.summary,
+                messages=turn.context.messages,
+                user_input=turn.user_input,
+                user_info=turn.context.user_context,
             )
-            thread.start()
+            await self._save_assistant_message(auth_id, turn, ai_reply)
+            return ai_reply
 
-        return ai_reply
+    async def stream_message(
+        self,
+        auth_id: str,
+        user_text: str | List[str],
+        user_id: UUID | None = None,
+        client_msg_ids: List[str | None] | None = None,
+        already_saved: List[bool] | None = None,
+        on_turn_start: Callable[[], None] | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of handle_message: yields reply tokens as they arrive.
+        The assistant message is persisted once, after the stream completes,
+        or with whatever was streamed if the turn is cancelled part-way.
+        """
+        async with self._user_turn(
+            auth_id, user_text, user_id, client_msg_ids, already_saved, on_turn_start
+        ) as turn:
+            chunks: list[str] = []
+            try:
+                # aclosing: a cancelled turn closes the LLM stream (and frees its slot) right away
+                async with aclosing(self.llm.stream_reply(
+                    summary=turn.context.summary,
+                    messages=turn.context.messages,
+                    user_input=turn.user_input,
+                    user_info=turn.context.user_context,
+                )) as deltas:
+                    async for delta in deltas:
+                        chunks.append(delta)
+                        yield delta
+            except (asyncio.CancelledError, GeneratorExit):
+                # Stopped or disconnected mid-reply: keep what the user already saw, nothing more
+                partial = "".join(chunks).strip()
+                if partial:
+                    logger.info(f"Reply for {auth_id} cancelled after {len(chunks)} deltas, saving partial reply")
+                    await asyncio.shield(self._save_assistant_message(auth_id, turn, partial))
+                raise
 
+            await self._save_assistant_message(auth_id, turn, "".join(chunks).strip())
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import uuid
+
+from fastapi import WebSocket
+
+from app.core.redis import redis_client
+from app.core.settings import get_settings
+from app.core.metrics import metrics
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+
+class _Connection:
+    """
+    A registered socket with its own bounded fan-out queue and sender task,
+    so one slow or half-open client can't hold up the shared listener.
+    """
+
+    def __init__(self, hub: "ConnectionHub", auth_id: str, connection_id: str, websocket: WebSocket):
+        self.hub = hub
+        self.auth_id = auth_id
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=settings.CHAT_FANOUT_QUEUE_SIZE)
+        self.task = asyncio.create_task(self._send_loop())
+
+    def offer(self, frame: dict) -> bool:
+        """Queues a frame without waiting; False when the client has fallen too far behind."""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def close(self) -> None:
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    async def _send_loop(self) -> None:
+        while True:
+            frame = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_json(frame), settings.CHAT_FANOUT_SEND_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self.hub.drop(self.auth_id, self.connection_id, f"send failed: {e!r}")
+                return
+            metrics.incr("ws.fanout_frames")
+
+
+class ConnectionHub:
+    """
+    Fans chat frames out to every live connection of a user, across workers and nodes.
+
+    Each process keeps a registry of its own sockets by auth_id and a single Redis
+    pub/sub subscriber. It subscribes to chat:{auth_id}:events while it holds at
+    least one socket for that user, so it only receives traffic for its own users.
+    The socket that produced a frame sends it directly and publishes it; the
+    listener queues it for every other registered socket of that user.
+    """
+
+    def __init__(self):
+        self._client = redis_client
+        self._pubsub = None
+        self._connections: dict[str, dict[str, _Connection]] = {}
+        # Users whose channel this process is subscribed to
+        self._channels: set[str] = set()
+        self._subscribed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _channel(self, auth_id: str) -> str:
+        return f"chat:{auth_id}:events"
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._task = asyncio.create_task(self._listen())
+        logger.info("Connection hub started")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self._pubsub.aclose()
+        self._channels.clear()
+        self._task = None
+        self._pubsub = None
+        logger.info("Connection hub stopped")
+
+    def _remove(self, auth_id: str, connection_id: str) -> _Connection | None:
+        """Drops a socket from the registry and stops its sender; returns it, if it was registered."""
+        sockets = self._connections.get(auth_id)
+        connection = sockets.pop(connection_id, None) if sockets else None
+        if connection is None:
+            return None
+        connection.close()
+        if not sockets:
+            del self._connections[auth_id]
+        metrics.set_gauge("ws.connections", sum(len(s) for s in self._connections.values()))
+        return connection
+
+    async def register(self, auth_id: str, websocket: WebSocket) -> str:
+        """Adds a socket to the registry and returns its connection id."""
+        auth_id = str(auth_id)
+        connection_id = uuid.uuid4().hex
+        sockets = self._connections.setdefault(auth_id, {})
+        sockets[connection_id] = _Connection(self, auth_id, connection_id, websocket)
+        metrics.set_gauge("ws.connections", sum(len(s) for s in self._connections.values()))
+
+        if self._pubsub is not None and auth_id not in self._channels:
+            try:
+                await self._pubsub.subscribe(self._channel(auth_id))
+            except BaseException:
+                # Roll back, so the next socket for this user subscribes again
+                self._remove(auth_id, connection_id)
+                raise
+            self._channels.add(auth_id)
+            self._subscribed.set()
+        return connection_id
+
+    async def unregister(self, auth_id: str, connection_id: str) -> None:
+        auth_id = str(auth_id)
+        if self._remove(auth_id, connection_id) is None:
+            return
+
+        if auth_id not in self._connections and auth_id in self._channels:
+            self._channels.discard(auth_id)
+            try:
+                await self._pubsub.unsubscribe(self._channel(auth_id))
+            except Exception as e:
+                logger.warning(f"Failed to unsubscribe fan-out channel for {auth_id}: {e}")
+
+    def queue_publish(self, pipe, auth_id: str, frame: dict, origin: str) -> None:
+        """Adds the publish to the caller's pipeline (batched with other writes)."""
+        if self._task is None:
+            return
+        pipe.publish(self._channel(auth_id), json.dumps({"origin": origin, "frame": frame}))
+
+    async def drop(self, auth_id: str, connection_id: str, reason: str) -> None:
+        """Unregisters a client that can't keep up and closes its socket so it reconnects (and resumes)."""
+        connection = self._connections.get(auth_id, {}).get(connection_id)
+        if connection is None:
+            return
+        logger.info(f"Dropping connection {connection_id} for {auth_id}: {reason}")
+        metrics.incr("ws.fanout_dropped")
+        await self.unregister(auth_id, connection_id)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=1013), settings.CHAT_FANOUT_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _deliver(self, auth_id: str, origin: str, frame: dict) -> None:
+        # Never awaits a socket: each connection's sender task does that
+        for connection_id, connection in list(self._connections.get(auth_id, {}).items()):
+            if connection_id == origin:
+                continue
+            if not connection.offer(frame):
+                await self.drop(auth_id, connection_id, "fan-out queue full")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                # get_message needs an active subscription; wait for the first socket
+                await self._subscribed.wait()
+                message = await self._pubsub.get_message(timeout=1.0)
+                if not message or message["type"] != "message":
+                    if not self._pubsub.subscribed:
+                        self._subscribed.clear()
+                    continue
+
+                channel = message["channel"]
+                auth_id = channel[len("chat:"):-len(":events")]
+                payload = json.loads(message["data"])
+                await self._deliver(auth_id, payload["origin"], payload["frame"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Connection hub listener error: {e}")
+                await asyncio.sleep(1)
+
+
+connection_hub = ConnectionHub()
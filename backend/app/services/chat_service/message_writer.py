@@ -0,0 +1,234 @@
+import asyncio
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.database.database import async_engine
+from app.models.chat_models import ChatMessage
+from app.services.redis_service.redis_service import RedisChatService
+from app.core.redis import redis_client
+from app.core.settings import get_settings
+from app.core.metrics import metrics
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+
+def _is_row_error(error: Exception) -> bool:
+    """
+    True when Postgres rejected the rows themselves (bad data, constraint violation):
+    retrying the same INSERT can never succeed. Anything else is retried as a batch
+    failure, including schema and permission errors (42xxx), which affect every row
+    alike and are fixed by a migration or grant, not by dropping messages.
+    """
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    sqlstate = getattr(getattr(error, "orig", None), "sqlstate", None) or ""
+    # 22 data exception, 23 integrity violation
+    return sqlstate[:2] in ("22", "23")
+
+
+class MessageWriter:
+    """
+    Write-behind persistence for chat messages.
+
+    Messages are queued in-process as soon as they are produced and a single
+    background flusher bulk-inserts them into chat_messages with one multi-row
+    INSERT per batch. A single consumer drains the queue in FIFO order, so
+    messages of the same user are always inserted (and get ids) in order.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval: float,
+        max_queue_size: int,
+        max_retries: int = settings.MESSAGE_WRITER_MAX_RETRIES,
+        enqueue_timeout: float = settings.MESSAGE_WRITER_ENQUEUE_TIMEOUT,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._redis = RedisChatService()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Message writer started")
+
+    async def enqueue(
+        self,
+        user_id: UUID,
+        role: str,
+        message: str,
+        auth_id: str | None = None,
+        client_msg_id: str | None = None,
+    ) -> None:
+        row = {
+            "user_id": user_id,
+            "role": role,
+            "message": message,
+            "client_msg_id": client_msg_id,
+            "created_at": datetime.utcnow(),
+            # Not a column: only used to advance the Redis session version after the insert
+            "auth_id": str(auth_id) if auth_id is not None else None,
+        }
+
+        # Not started (e.g. scripts / workers): write through directly
+        if self._task is None:
+            await self._persist([row])
+            return
+
+        # Bounded queue: applies backpressure when Postgres falls behind,
+        # but never holds a chat turn hostage for longer than enqueue_timeout
+        try:
+            await asyncio.wait_for(self._queue.put(row), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("message_writer.enqueue_timeouts")
+            await self._dead_letter([row], "write-behind queue full")
+
+    async def flush(self) -> None:
+        """Waits until every message queued so far has been written."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Drains the queue and stops the flusher. Called on shutdown."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Message writer shutdown timed out, {self._queue.qsize()} messages not persisted")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Message writer stopped")
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+
+            # Collect more rows until the batch is full or the flush window closes
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_with_retry(self, batch: list[dict]) -> None:
+        """
+        Retries transient failures up to max_retries times. A batch Postgres rejects
+        outright is split so one bad row can't block the rest; rows that still fail,
+        like batches that exhaust their retries, go to the dead-letter stream.
+        """
+        delay = 0.5
+        error: Exception | None = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await self._persist(batch)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if _is_row_error(e):
+                    if len(batch) == 1:
+                        await self._dead_letter(batch, repr(e))
+                        return
+                    logger.warning(f"Postgres rejected a batch of {len(batch)} chat messages, writing rows one by one: {e!r}")
+                    for row in batch:
+                        await self._write_with_retry([row])
+                    return
+
+                error = e
+                if attempt < self.max_retries:
+                    logger.error(f"Failed to flush {len(batch)} chat messages, retrying in {delay}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 10)
+
+        await self._dead_letter(batch, f"gave up after {self.max_retries} attempts: {error!r}")
+
+    async def _dead_letter(self, batch: list[dict], reason: str) -> None:
+        """Parks rows that can't be written so the writer keeps going; they can be replayed by hand."""
+        metrics.incr("message_writer.dead_lettered", len(batch))
+        for row in batch:
+            logger.error(f"Dead-lettering chat message for user {row['user_id']} ({reason})")
+            try:
+                await redis_client.xadd(
+                    settings.MESSAGE_WRITER_DEAD_LETTER_KEY,
+                    {
+                        **{key: "" if value is None else str(value) for key, value in row.items()},
+                        "error": reason,
+                    },
+                    maxlen=settings.SUMMARY_STREAM_MAXLEN,
+                    approximate=True,
+                )
+            except Exception as e:
+                # Last resort: the log line is all that's left of it
+                logger.error(f"Failed to dead-letter chat message {row!r}: {e}")
+
+    async def _persist(self, batch: list[dict]) -> None:
+        auth_ids = {row["user_id"]: row["auth_id"] for row in batch if row["auth_id"]}
+        inserted = await self._insert_batch(
+            [{key: value for key, value in row.items() if key != "auth_id"} for row in batch]
+        )
+
+        last_ids: dict[str, int] = {}
+        for message_id, user_id in inserted:
+            auth_id = auth_ids.get(user_id)
+            if auth_id is not None:
+                last_ids[auth_id] = max(message_id, last_ids.get(auth_id, 0))
+
+        try:
+            await self._redis.set_session_last_message_ids(last_ids)
+        except Exception as e:
+            # Stale stamp only costs a full bootstrap on the next reconnect
+            logger.warning(f"Failed to advance session versions: {e}")
+
+    async def _insert_batch(self, batch: list[dict]) -> list[tuple[int, UUID]]:
+        # One multi-row INSERT ... VALUES (...), (...) per batch, one commit.
+        # A retried client_msg_id that slipped past the Redis dedup window is skipped,
+        # not allowed to fail the whole batch. Batches without client ids leave the
+        # column (and the constraint) out, so they still write before its migration runs.
+        if any(row["client_msg_id"] for row in batch):
+            stmt = insert(ChatMessage).values(batch).on_conflict_do_nothing(
+                constraint="uq_chat_messages_user_id_client_msg_id"
+            )
+        else:
+            stmt = insert(ChatMessage).values(
+                [{key: value for key, value in row.items() if key != "client_msg_id"} for row in batch]
+            )
+        async with async_engine.begin() as conn:
+            result = await conn.execute(stmt.returning(ChatMessage.id, ChatMessage.user_id))
+            inserted = result.all()
+        logger.debug(f"Flushed {len(batch)} chat messages")
+        return inserted
+
+
+message_writer = MessageWriter(
+    batch_size=settings.MESSAGE_WRITER_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_WRITER_FLUSH_INTERVAL_MS / 1000,
+    max_queue_size=settings.MESSAGE_WRITER_QUEUE_SIZE,
+)
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+from app.services.redis_service.redis_service import RedisChatService, parse_frame_id
+from app.services.chat_service.connection_hub import connection_hub
+from app.core.settings import get_settings
+from app.core.metrics import metrics
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+
+class ReplyRelay:
+    """
+    The Redis side of one connection's outgoing frames, kept off the token path.
+
+    Reply frames are stamped with their replay id ("<reply_id>-<seq>") locally,
+    so the socket send never waits on Redis. A background task then appends them
+    to the reply buffer (CHAT_RESUME_ENABLED) and publishes them to the user's
+    other connections (CHAT_FANOUT_ENABLED), draining whatever has queued up into
+    one pipeline per round trip. Redis errors cost replay / fan-out, never the reply.
+    """
+
+    def __init__(self, redis_service: RedisChatService, auth_id: str, origin: str):
+        self.redis = redis_service
+        self.auth_id = auth_id
+        self.origin = origin
+        self.buffered = settings.CHAT_RESUME_ENABLED
+        self._reply_id = 0
+        self._seq = 0
+        self._open = False
+        self._queue: asyncio.Queue[tuple[str, int, int, dict | None]] = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    def begin_reply(self) -> None:
+        """Call once the user's turn lock is held, so replies of one user never overlap."""
+        if not self.buffered:
+            return
+        # Turns of a user are serialized, so start time orders replies (kept strictly increasing)
+        self._reply_id = max(int(time.time() * 1000), self._reply_id + 1)
+        self._seq = 0
+        self._open = True
+        self._queue.put_nowait(("begin", self._reply_id, 0, None))
+
+    def end_reply(self) -> None:
+        if self._open:
+            self._open = False
+            self._queue.put_nowait(("end", self._reply_id, 0, None))
+
+    def stamp(self, frame: dict) -> dict:
+        """Gives a reply frame its replay id (frames outside a reply get none); call before sending it."""
+        if self._open:
+            frame["id"] = f"{self._reply_id}-{self._seq}"
+            self._seq += 1
+        return frame
+
+    def push(self, frame: dict, fanout: bool = True) -> None:
+        """Buffers (if stamped) and, unless fanout is False, fans out a frame in the background."""
+        reply_id, seq = parse_frame_id(frame["id"]) if frame.get("id") else (0, -1)
+        self._queue.put_nowait(("frame" if fanout else "own_frame", reply_id, seq, frame))
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Flushes what's queued (bounded by timeout) and stops the writer."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Reply relay for {self.auth_id} closed with {self._queue.qsize()} frames unsent")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                pipe = self.redis.client.pipeline(transaction=False)
+                for kind, reply_id, seq, frame in batch:
+                    if kind == "begin":
+                        self.redis.queue_begin_reply(pipe, self.auth_id, reply_id)
+                    elif kind == "end":
+                        self.redis.queue_end_reply(pipe, self.auth_id, reply_id)
+                    else:
+                        if seq >= 0:
+                            self.redis.queue_reply_frame(pipe, self.auth_id, reply_id, seq, frame)
+                        if kind == "frame":
+                            connection_hub.queue_publish(pipe, self.auth_id, frame, origin=self.origin)
+                if len(pipe):
+                    await pipe.execute()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.incr("chat.reply_relay.errors")
+                logger.warning(f"Failed to buffer / fan out {len(batch)} frames for {self.auth_id}: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import time
+import uuid
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncIterator
+
+from app.core.redis import redis_client
+from app.core.settings import get_settings
+from app.core.metrics import metrics
+from app.core.logger import get_logger
+from app.services.llm_service.resilience import LLMUnavailableError
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+
+class Priority(IntEnum):
+    # Lower value is admitted first
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+# Drops expired leases, then takes one if the holder count is under the limit
+# for this priority (background may not use the slots reserved for interactive).
+ACQUIRE_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local lease_ms = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - lease_ms)
+if redis.call('ZCARD', key) < limit then
+    redis.call('ZADD', key, now, ARGV[4])
+    redis.call('PEXPIRE', key, lease_ms)
+    return 1
+end
+return 0
+"""
+
+
+class RedisLLMSemaphore:
+    """
+    Cluster-wide concurrency cap shared by every API node and summarizer worker:
+    a sorted set of lease tokens scored by acquisition time. Leases expire after
+    lease_ms so a crashed process can't leak slots. Redis errors fail open.
+    """
+
+    def __init__(
+        self,
+        limit: int = settings.LLM_CLUSTER_MAX_CONCURRENCY,
+        interactive_reserve: int = settings.LLM_CLUSTER_INTERACTIVE_RESERVE,
+        lease_ms: int = settings.LLM_CLUSTER_LEASE_MS,
+    ):
+        self.client = redis_client
+        self.key = "llm:admission:holders"
+        self.limit = limit
+        self.interactive_reserve = interactive_reserve
+        self.lease_ms = lease_ms
+        self._acquire = self.client.register_script(ACQUIRE_SCRIPT)
+
+    def _limit(self, priority: Priority) -> int:
+        if priority is Priority.BACKGROUND:
+            return max(self.limit - self.interactive_reserve, 1)
+        return self.limit
+
+    async def _try(self, priority: Priority, token: str) -> bool:
+        return bool(await self._acquire(
+            keys=[self.key], args=[int(time.time() * 1000), self.lease_ms, self._limit(priority), token]
+        ))
+
+    async def acquire(self, priority: Priority) -> str | None:
+        token = uuid.uuid4().hex
+        # Interactive callers poll faster, so they win freed slots more often
+        poll = 0.02 if priority is Priority.INTERACTIVE else 0.2
+
+        while True:
+            try:
+                acquired = await self._try(priority, token)
+            except Exception as e:
+                logger.warning(f"Cluster LLM semaphore unavailable, admitting locally: {e}")
+                metrics.incr("llm.admission.cluster_errors")
+                return None
+            if acquired:
+                return token
+            await asyncio.sleep(poll)
+
+    async def try_acquire(self, priority: Priority) -> str | None:
+        """
+        Single attempt, no waiting. Returns None when the cluster is full and,
+        unlike acquire, also when Redis is unavailable (fails closed).
+        """
+        token = uuid.uuid4().hex
+        try:
+            return token if await self._try(priority, token) else None
+        except Exception as e:
+            logger.warning(f"Cluster LLM semaphore unavailable: {e}")
+            metrics.incr("llm.admission.cluster_errors")
+            return None
+
+    async def release(self, token: str | None) -> None:
+        if token is None:
+            return
+        try:
+            await self.client.zrem(self.key, token)
+        except Exception as e:
+            logger.warning(f"Failed to release cluster LLM slot: {e}")
+
+
+class LLMAdmissionController:
+    """
+    Process-wide LLM admission: at most max_concurrency calls in flight, waiters
+    served by priority (interactive replies before summaries), and background work
+    capped at background_limit slots so it can never starve live chats.
+    With a cluster semaphore, a process slot is taken first, then a cluster slot.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = settings.LLM_MAX_CONCURRENCY,
+        background_limit: int = settings.LLM_BACKGROUND_MAX_CONCURRENCY,
+        cluster: RedisLLMSemaphore | None = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.background_limit = background_limit
+        self.cluster = cluster
+        self._active = {priority: 0 for priority in Priority}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def _can_admit(self, priority: Priority) -> bool:
+        if sum(self._active.values()) >= self.max_concurrency:
+            return False
+        if priority is Priority.BACKGROUND and self._active[priority] >= self.background_limit:
+            return False
+        return True
+
+    def _wake(self) -> None:
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # Waiter gave up (timeout / cancellation)
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit(Priority(priority)):
+                break
+            heapq.heappop(self._waiters)
+            self._active[Priority(priority)] += 1
+            future.set_result(None)
+        self._report()
+
+    def _report(self) -> None:
+        metrics.set_gauge("llm.admission.active", sum(self._active.values()))
+        metrics.set_gauge("llm.admission.queued", sum(1 for *_, f in self._waiters if not f.done()))
+
+    async def _acquire_local(self, priority: Priority, timeout: float | None) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wake()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot back
+                self._release_local(priority)
+            else:
+                future.cancel()
+                self._report()
+            raise
+
+    def _release_local(self, priority: Priority) -> None:
+        self._active[priority] -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, timeout: float | None = None) -> AsyncIterator[None]:
+        """
+        Holds one LLM slot for the duration of the block.
+        Raises LLMUnavailableError if no slot frees up within timeout seconds.
+        """
+        started = time.perf_counter()
+        try:
+            await self._acquire_local(priority, timeout)
+        except asyncio.TimeoutError as e:
+            metrics.incr(f"llm.admission.rejected.{priority.name.lower()}")
+            raise LLMUnavailableError(f"No LLM capacity within {timeout}s") from e
+
+        token = None
+        try:
+            if self.cluster:
+                remaining = None if timeout is None else max(timeout - (time.perf_counter() - started), 0)
+                try:
+                    token = await asyncio.wait_for(self.cluster.acquire(priority), remaining)
+                except asyncio.TimeoutError as e:
+                    metrics.incr(f"llm.admission.rejected.{priority.name.lower()}")
+                    raise LLMUnavailableError(f"No cluster LLM capacity within {timeout}s") from e
+
+            metrics.observe(f"llm.admission_wait.{priority.name.lower()}", time.perf_counter() - started)
+            yield
+        finally:
+            if self.cluster:
+                await self.cluster.release(token)
+            self._release_local(priority)
+
+    @asynccontextmanager
+    async def try_slot(self, priority: Priority) -> AsyncIterator[bool]:
+        """
+        Holds one LLM slot for the block only if one is free right now (never
+        queues, never jumps ahead of waiters). Yields whether a slot was taken.
+        """
+        if any(not f.done() for *_, f in self._waiters) or not self._can_admit(priority):
+            yield False
+            return
+
+        token = None
+        if self.cluster:
+            token = await self.cluster.try_acquire(priority)
+            # Re-checked: the cluster round-trip may have let others take the last local slot
+            if token is None or not self._can_admit(priority):
+                await self.cluster.release(token)
+                yield False
+                return
+
+        self._active[priority] += 1
+        self._report()
+        try:
+            yield True
+        finally:
+            if self.cluster:
+                await self.cluster.release(token)
+            self._release_local(priority)
+
+
+llm_admission = LLMAdmissionController(
+    cluster=RedisLLMSemaphore() if settings.LLM_CLUSTER_MAX_CONCURRENCY > 0 else None,
+)
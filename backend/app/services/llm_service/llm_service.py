@@ -1,7 +1,14 @@
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict
+import asyncio
 import os
-from openai import AsyncOpenAI
+import time
+from app.core.llm_client import llm_client
+from app.services.llm_service.prompt_builder import PromptBuilder
+from app.services.llm_service.response_cache import response_cache
+from app.services.llm_service.resilience import LLMUnavailableError, resilient_caller
+from app.services.llm_service.admission import Priority, llm_admission
 from app.core.settings import get_settings
+from app.core.metrics import metrics
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
@@ -10,12 +17,62 @@ settings = get_settings()
 
 class LLMService:
     def __init__(self):
-        self.client = AsyncOpenAI(
-            base_url=settings.OPENROUTER_BASE_URL,
-            api_key=settings.OPENROUTER_API_KEY,
-        )
+        # Process-wide client: instances are cheap and share one HTTP pool
+        self.client = llm_client
 
         self.model = settings.OPENROUTER_MODEL
+        self.temperature = 0.3
+        self.prompt_builder = PromptBuilder()
+
+    def _build_messages(
+        self,
+        summary: str,
+        messages: List[Dict],
+        user_input: str,
+        user_info: str
+    ) -> List[Dict]:
+        """
+        Builds the prompt messages sent to the model, within the configured token budgets
+        """
+        return self.prompt_builder.build(summary, messages, user_input, user_info)
+
+    def _record_usage(self, usage) -> None:
+        """
+        Token usage per call, including prompt tokens served from the provider's prefix cache.
+        Cache hit rate = llm.cached_prompt_tokens / llm.prompt_tokens.
+        """
+        if not usage:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+        metrics.incr("llm.calls")
+        metrics.incr("llm.prompt_tokens", usage.prompt_tokens or 0)
+        metrics.incr("llm.cached_prompt_tokens", cached)
+        metrics.incr("llm.completion_tokens", usage.completion_tokens or 0)
+        if cached:
+            metrics.incr("llm.prefix_cache_hits")
+        logger.info(
+            f"LLM usage: {usage.prompt_tokens} prompt tokens ({cached} cached), "
+            f"{usage.completion_tokens} completion tokens"
+        )
+
+    @staticmethod
+    def _hedge_slot():
+        """A hedged second attempt needs its own interactive slot, taken without waiting."""
+        return llm_admission.try_slot(Priority.INTERACTIVE)
+
+    def _response_cache_key(self, prompt_messages: List[Dict], summary: str, user_info: str) -> str | None:
+        """
+        Key for the exact-match response cache, or None when caching is off
+        or the prompt carries personal context (summary / profile).
+        """
+        if not settings.LLM_RESPONSE_CACHE_ENABLED:
+            return None
+        if summary or user_info:
+            metrics.incr("llm.response_cache.skipped")
+            return None
+        return response_cache.make_key(prompt_messages, self.model, self.temperature)
 
     async def generate_reply(
         self,
@@ -27,44 +84,177 @@ class LLMService:
         """
         Generates AI response using OpenRouter GPT model (Asynchronous)
         """
+        prompt_messages = self._build_messages(summary, messages, user_input, user_info)
+
+        cache_key = self._response_cache_key(prompt_messages, summary, user_info)
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached:
+                logger.info("AI reply served from response cache")
+                return cached
 
-        # ---- Build prompt messages ----
-        prompt_messages = []
-
-        # 1️⃣ System memory / summary
-        # Note: Left-aligned to avoid leading whitespace tokens in the prompt
-        prompt_messages.append({
-            "role": "system",
-            "content": f"""You are an Disha AI healthcare assistant.
-
-PATIENT MEMORY SUMMARY:
-{summary}
-and user general information and medications history:
-{user_info}
-
-Give safe, clear, and concise guidance and don't ans unneccessary questions apart from health."""
-        })
-
-        # 2️⃣ Previous conversation (last 3–5 messages ideally)
-        for msg in messages:
-            prompt_messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-
-        # 3️⃣ Current user input
-        prompt_messages.append({
-            "role": "user",
-            "content": user_input
-        })
-
-        # ---- Call OpenRouter (Awaited) ----
+        # ---- Call OpenRouter (deadline, hedging, fallback model, circuit breaker) ----
         logger.info(f"Generating AI reply using model: {self.model}")
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=prompt_messages,
-            temperature=0.3,
-        )
 
+        async def create(model: str):
+            return await self.client.chat.completions.create(
+                model=model,
+                messages=prompt_messages,
+                temperature=self.temperature,
+            )
+
+        # Interactive priority: admitted ahead of queued summaries
+        async with llm_admission.slot(Priority.INTERACTIVE, timeout=settings.LLM_ADMISSION_TIMEOUT):
+            response = await resilient_caller.call(
+                self.model, create, latency_metric="llm.reply_latency", hedge_slot=self._hedge_slot
+            )
+
+        self._record_usage(response.usage)
         logger.info("AI reply generated successfully")
+        reply = response.choices[0].message.content.strip()
+
+        if cache_key:
+            await response_cache.set(cache_key, reply)
+        return reply
+
+    async def stream_reply(
+        self,
+        summary: str,
+        messages: List[Dict],
+        user_input: str,
+        user_info: str
+    ) -> AsyncIterator[str]:
+        """
+        Streams AI response tokens as they arrive from OpenRouter.
+        Logs time-to-first-token and total latency for each reply.
+        Raises LLMUnavailableError when no model produces a token in time or the stream overruns its deadline.
+        """
+        prompt_messages = self._build_messages(summary, messages, user_input, user_info)
+
+        cache_key = self._response_cache_key(prompt_messages, summary, user_info)
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached:
+                logger.info("AI reply served from response cache")
+                yield cached
+                return
+
+        logger.info(f"Streaming AI reply using model: {self.model}")
+        started = time.perf_counter()
+        chunks: List[str] = []
+
+        async def open_stream(model: str):
+            """Opens the stream and waits for its first token, so hedging/fallback cover time-to-first-token."""
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=prompt_messages,
+                temperature=self.temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            try:
+                delta = await self._next_delta(stream)
+            except BaseException:
+                await stream.close()
+                raise
+            return stream, delta
+
+        async def close_stream(opened) -> None:
+            await opened[0].close()
+
+        # The slot is held until the stream ends; interactive priority goes ahead of queued summaries
+        async with llm_admission.slot(Priority.INTERACTIVE, timeout=settings.LLM_ADMISSION_TIMEOUT):
+            # Resilience covers the first token; time-to-first-token is recorded per attempt
+            stream, delta = await resilient_caller.call(
+                self.model,
+                open_stream,
+                latency_metric="llm.time_to_first_token",
+                cleanup=close_stream,
+                hedge_slot=self._hedge_slot,
+            )
+            logger.info(f"AI reply first token after {(time.perf_counter() - started) * 1000:.0f} ms")
+
+            # The rest of the stream is bounded by LLM_STREAM_TIMEOUT overall
+            deadline = started + settings.LLM_STREAM_TIMEOUT
+            try:
+                while delta is not None:
+                    chunks.append(delta)
+                    yield delta
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    delta = await asyncio.wait_for(self._next_delta(stream), timeout=remaining)
+            except asyncio.TimeoutError as e:
+                metrics.incr("llm.deadline_exceeded")
+                raise LLMUnavailableError(
+                    f"LLM stream exceeded {settings.LLM_STREAM_TIMEOUT}s deadline"
+                ) from e
+            finally:
+                await stream.close()
+
+        metrics.observe("llm.stream_latency", time.perf_counter() - started)
+        logger.info(f"AI reply streamed successfully in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        if cache_key:
+            await response_cache.set(cache_key, "".join(chunks).strip())
+
+    async def _next_delta(self, stream) -> str | None:
+        """
+        Next non-empty content delta from the stream, or None when it ends.
+        Usage arrives on the final chunk, which has no choices.
+        """
+        while True:
+            try:
+                chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                return None
+            if chunk.usage:
+                self._record_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                return chunk.choices[0].delta.content
+
+    async def summarize(self, old_summary: str, conversation: str, max_words: int) -> str:
+        """
+        Folds new conversation lines into the long-term summary.
+        """
+        # Note: Prompts are left-aligned to avoid leading whitespace token waste
+        prompt_messages = [
+            {
+                "role": "system",
+                "content": f"""Your name is disha. You are a long-term medical summary assistant.
+
+RULES:
+- Keep under {max_words} words
+- Remove outdated or resolved symptoms
+- Preserve allergies, chronic conditions, preferences ans some important information that is useful for the user and our memory
+- Resolve contradictions"""
+            },
+            {
+                "role": "user",
+                "content": f"""EXISTING SUMMARY:
+{old_summary}
+
+NEW MESSAGES:
+{conversation}
+
+OUTPUT:
+Updated summary only."""
+            },
+        ]
+
+        async def create(model: str):
+            return await self.client.chat.completions.create(
+                model=model,
+                messages=prompt_messages,
+                temperature=0,
+                max_tokens=300,
+            )
+
+        # Background work: deadline, fallback and breaker, but no hedging (it would double the cost)
+        # Background priority: waits behind live chats and never takes more than its share of slots
+        async with llm_admission.slot(Priority.BACKGROUND):
+            response = await resilient_caller.call(
+                self.model, create, latency_metric="llm.summary_latency", hedge=False
+            )
+        self._record_usage(response.usage)
         return response.choices[0].message.content.strip()
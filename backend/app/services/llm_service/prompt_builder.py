@@ -0,0 +1,155 @@
+from functools import lru_cache
+from typing import Dict, List
+
+from app.core.settings import get_settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+TRUNCATION_MARKER = "\n[...truncated]"
+
+# Global static prefix: byte-identical for every user and turn, so the provider's
+# prompt cache can serve it. Anything per-user or per-turn goes after it.
+# Note: Left-aligned to avoid leading whitespace tokens in the prompt
+STATIC_SYSTEM_PROMPT = """You are an Disha AI healthcare assistant.
+
+Give safe, clear, and concise guidance and don't ans unneccessary questions apart from health."""
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    Local tokenizer, loaded once. Returns None (character estimate) when tiktoken
+    or its encoding file is unavailable, so prompt assembly never fails on it.
+    """
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(settings.PROMPT_TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        # ~4 characters per token for English text
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str | None, budget: int) -> str:
+    """Keeps the head of text within budget tokens, marking the cut."""
+    if not text or count_tokens(text) <= budget:
+        return text or ""
+    if budget <= 0:
+        return ""
+
+    encoding = _encoding()
+    keep = max(budget - count_tokens(TRUNCATION_MARKER), 0)
+    if encoding is None:
+        head = text[: keep * 4]
+    else:
+        head = encoding.decode(encoding.encode(text, disallowed_special=())[:keep])
+    return head + TRUNCATION_MARKER
+
+
+class PromptBuilder:
+    """
+    Assembles the chat prompt within per-section token budgets:
+    summary, profile, history (oldest turns dropped first) and current input.
+    Segments are ordered from most to least stable (static prefix, per-user block,
+    volatile turns) so provider prefix caching can reuse as much as possible.
+    """
+
+    def __init__(
+        self,
+        summary_budget: int = settings.PROMPT_SUMMARY_TOKEN_BUDGET,
+        profile_budget: int = settings.PROMPT_PROFILE_TOKEN_BUDGET,
+        history_budget: int = settings.PROMPT_HISTORY_TOKEN_BUDGET,
+        input_budget: int = settings.PROMPT_INPUT_TOKEN_BUDGET,
+        cache_control: bool = settings.LLM_PROMPT_CACHE_CONTROL,
+    ):
+        self.summary_budget = summary_budget
+        self.profile_budget = profile_budget
+        self.history_budget = history_budget
+        self.input_budget = input_budget
+        self.cache_control = cache_control
+
+    def _system_message(self, content: str) -> Dict:
+        """
+        System segment; with cache_control on, marks it as a cache breakpoint
+        for providers that use explicit hints (Anthropic/Gemini via OpenRouter).
+        """
+        if not self.cache_control:
+            return {"role": "system", "content": content}
+        return {
+            "role": "system",
+            "content": [
+                {"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}
+            ],
+        }
+
+    def fit_history(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Newest-first walk: keeps turns while they fit the history budget.
+        Uses the cached "tokens" count when the message carries one.
+        """
+        kept: List[Dict] = []
+        used = 0
+        for msg in reversed(messages):
+            tokens = msg.get("tokens")
+            if tokens is None:
+                tokens = count_tokens(msg["content"])
+            if used + tokens > self.history_budget:
+                break
+            kept.append(msg)
+            used += tokens
+
+        if len(kept) < len(messages):
+            logger.info(
+                f"Prompt history trimmed to {len(kept)}/{len(messages)} turns ({used} tokens)"
+            )
+        return list(reversed(kept))
+
+    def build(
+        self,
+        summary: str,
+        messages: List[Dict],
+        user_input: str,
+        user_info: str,
+    ) -> List[Dict]:
+        summary = truncate_to_tokens(summary, self.summary_budget)
+        user_info = truncate_to_tokens(user_info, self.profile_budget)
+        user_input = truncate_to_tokens(user_input, self.input_budget)
+
+        # 1️⃣ Global static prefix
+        prompt_messages = [self._system_message(STATIC_SYSTEM_PROMPT)]
+
+        # 2️⃣ Per-user stable block: profile changes rarely, the summary every few turns
+        if user_info or summary:
+            prompt_messages.append(self._system_message(f"""USER GENERAL INFORMATION AND MEDICATIONS HISTORY:
+{user_info}
+
+PATIENT MEMORY SUMMARY:
+{summary}"""))
+
+        # 3️⃣ Volatile turns: previous conversation, oldest turns trimmed first
+        for msg in self.fit_history(messages):
+            prompt_messages.append({
+                "role": msg["role"],
+                "content": msg["content"]
+            })
+
+        # 4️⃣ Current user input
+        prompt_messages.append({
+            "role": "user",
+            "content": user_input
+        })
+
+        return prompt_messages
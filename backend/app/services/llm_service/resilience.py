@@ -0,0 +1,196 @@
+import asyncio
+import time
+from contextlib import AsyncExitStack
+from typing import AsyncContextManager, Awaitable, Callable, List, TypeVar
+
+from app.core.settings import get_settings
+from app.core.metrics import metrics
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+
+class LLMUnavailableError(Exception):
+    """Every configured model failed, timed out or is behind an open circuit."""
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker: opens after failure_threshold consecutive failures,
+    lets a single trial call through after reset_timeout (half-open),
+    and closes again on the first success.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = settings.LLM_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = settings.LLM_BREAKER_RESET_SECONDS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures: dict[str, int] = {}
+        self._opened_at: dict[str, float] = {}
+
+    def allow(self, model: str) -> bool:
+        opened_at = self._opened_at.get(model)
+        if opened_at is None:
+            return True
+        if time.monotonic() - opened_at >= self.reset_timeout:
+            # Half-open: re-arm the timer so only this caller probes the model
+            self._opened_at[model] = time.monotonic()
+            return True
+        return False
+
+    def record_success(self, model: str) -> None:
+        self._failures.pop(model, None)
+        if self._opened_at.pop(model, None) is not None:
+            logger.info(f"Circuit closed for model {model}")
+
+    def record_failure(self, model: str) -> None:
+        failures = self._failures.get(model, 0) + 1
+        self._failures[model] = failures
+        if failures >= self.failure_threshold:
+            if model not in self._opened_at:
+                logger.warning(f"Circuit opened for model {model} after {failures} failures")
+                metrics.incr("llm.circuit_opened")
+            self._opened_at[model] = time.monotonic()
+
+
+def hedge_delay(latency_metric: str) -> float:
+    """Seconds to wait before hedging: the configured percentile of recent latencies, clamped."""
+    observed_ms = metrics.percentile(latency_metric, settings.LLM_HEDGE_PERCENTILE)
+    if observed_ms is None:
+        return settings.LLM_HEDGE_MAX_DELAY
+    return min(max(observed_ms / 1000, settings.LLM_HEDGE_MIN_DELAY), settings.LLM_HEDGE_MAX_DELAY)
+
+
+async def hedged(
+    attempt: Callable[[], Awaitable[T]],
+    delay: float,
+    cleanup: Callable[[T], Awaitable[None]] | None = None,
+    hedge_slot: Callable[[], AsyncContextManager[bool]] | None = None,
+) -> T:
+    """
+    Runs attempt(); if it hasn't finished after delay seconds, fires a second
+    identical attempt and returns whichever succeeds first. The loser is cancelled
+    (or, if it also completed, handed to cleanup, e.g. to close an open stream).
+    With hedge_slot, the second attempt runs only if it yields True (a free
+    admission slot, held until both attempts are settled); otherwise it is skipped.
+    """
+    first = asyncio.ensure_future(attempt())
+    tasks = [first]
+    winner: asyncio.Future | None = None
+    slots = AsyncExitStack()
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if hedge_slot is None or await slots.enter_async_context(hedge_slot()):
+                metrics.incr("llm.hedged_requests")
+                tasks.append(asyncio.ensure_future(attempt()))
+            else:
+                metrics.incr("llm.hedges_skipped")
+
+        error: BaseException | None = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    if task is not first:
+                        metrics.incr("llm.hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        try:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif cleanup and not task.cancelled() and task.exception() is None:
+                    await cleanup(task.result())
+        finally:
+            await slots.aclose()
+
+
+class ResilientLLMCaller:
+    """
+    Wraps a single LLM call with a per-attempt deadline, an optional hedged
+    second attempt, fallback to OPENROUTER_FALLBACK_MODEL and a per-model
+    circuit breaker. The whole call is bounded by LLM_TOTAL_TIMEOUT.
+    """
+
+    def __init__(self, breaker: CircuitBreaker | None = None):
+        self.breaker = breaker or CircuitBreaker()
+
+    def models(self, primary: str) -> List[str]:
+        models = [primary]
+        fallback = settings.OPENROUTER_FALLBACK_MODEL
+        if fallback and fallback != primary:
+            models.append(fallback)
+        return models
+
+    async def call(
+        self,
+        primary: str,
+        make_call: Callable[[str], Awaitable[T]],
+        latency_metric: str,
+        hedge: bool = settings.LLM_HEDGE_ENABLED,
+        cleanup: Callable[[T], Awaitable[None]] | None = None,
+        hedge_slot: Callable[[], AsyncContextManager[bool]] | None = None,
+    ) -> T:
+        try:
+            return await asyncio.wait_for(
+                self._call(primary, make_call, latency_metric, hedge, cleanup, hedge_slot),
+                timeout=settings.LLM_TOTAL_TIMEOUT,
+            )
+        except asyncio.TimeoutError as e:
+            metrics.incr("llm.deadline_exceeded")
+            raise LLMUnavailableError(
+                f"LLM call exceeded {settings.LLM_TOTAL_TIMEOUT}s total deadline"
+            ) from e
+
+    async def _call(self, primary, make_call, latency_metric, hedge, cleanup, hedge_slot):
+        last_error: BaseException | None = None
+
+        for model in self.models(primary):
+            if not self.breaker.allow(model):
+                logger.warning(f"Circuit open for model {model}, skipping")
+                metrics.incr("llm.circuit_skips")
+                continue
+
+            async def attempt(model=model):
+                started = time.perf_counter()
+                result = await asyncio.wait_for(make_call(model), timeout=settings.LLM_ATTEMPT_TIMEOUT)
+                metrics.observe(latency_metric, time.perf_counter() - started)
+                return result
+
+            try:
+                if hedge:
+                    result = await hedged(attempt, hedge_delay(latency_metric), cleanup, hedge_slot)
+                else:
+                    result = await attempt()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                self.breaker.record_failure(model)
+                metrics.incr("llm.attempt_failures")
+                logger.warning(f"LLM call to {model} failed: {e!r}")
+                continue
+
+            self.breaker.record_success(model)
+            if model != primary:
+                metrics.incr("llm.fallback_used")
+            return result
+
+        raise LLMUnavailableError("All LLM models failed or are unavailable") from last_error
+
+
+resilient_caller = ResilientLLMCaller()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import time
+from typing import Dict, List
+
+from app.core.redis import redis_client
+from app.core.settings import get_settings
+from app.core.metrics import metrics
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+
+def _normalize(content) -> str:
+    """Case- and whitespace-insensitive form of a message's text."""
+    if isinstance(content, list):
+        content = "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return " ".join((content or "").split()).casefold()
+
+
+class LLMResponseCache:
+    """
+    Exact-match reply cache in Redis, keyed by a hash of the normalized prompt,
+    model and temperature. Entries expire after the TTL; an insertion-time index
+    (sorted set) bounds the total size by evicting the oldest entries.
+    Redis errors are logged and treated as misses so chat never fails on the cache.
+    """
+
+    def __init__(
+        self,
+        ttl: int = settings.LLM_RESPONSE_CACHE_TTL,
+        max_entries: int = settings.LLM_RESPONSE_CACHE_MAX_ENTRIES,
+    ):
+        self.client = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index_key = "llm:response_cache:index"
+
+    def _entry_key(self, digest: str) -> str:
+        return f"llm:response_cache:{digest}"
+
+    def make_key(self, messages: List[Dict], model: str, temperature: float) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "temperature": temperature,
+                "messages": [[m["role"], _normalize(m["content"])] for m in messages],
+            },
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, digest: str) -> str | None:
+        try:
+            reply = await self.client.get(self._entry_key(digest))
+        except Exception as e:
+            logger.warning(f"LLM response cache read failed: {e}")
+            reply = None
+
+        metrics.incr("llm.response_cache.hits" if reply else "llm.response_cache.misses")
+        return reply
+
+    async def set(self, digest: str, reply: str) -> None:
+        if not reply:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.set(self._entry_key(digest), reply, ex=self.ttl)
+            pipe.zadd(self.index_key, {digest: time.time()})
+            # Entries older than the TTL are already gone; drop them from the index too
+            pipe.zremrangebyscore(self.index_key, "-inf", time.time() - self.ttl)
+            pipe.zcard(self.index_key)
+            *_, size = await pipe.execute()
+
+            overflow = size - self.max_entries
+            if overflow > 0:
+                evicted = await self.client.zpopmin(self.index_key, overflow)
+                if evicted:
+                    await self.client.delete(*[self._entry_key(d) for d, _ in evicted])
+                    metrics.incr("llm.response_cache.evictions", len(evicted))
+        except Exception as e:
+            logger.warning(f"LLM response cache write failed: {e}")
+
+
+response_cache = LLMResponseCache()
@@ -1,13 +1,21 @@
 from typing import List
 from datetime import datetime
-from sqlmodel import Session, select
-
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
+import uuid
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.models.chat_models import ChatMessage, UserSummary
 from app.models.user_model import UserOnboarding
 from app.services.redis_service.redis_service import RedisChatService
+from app.services.llm_service.llm_service import LLMService
+from app.services.memory_service.session_snapshot import (
+    SessionSnapshot,
+    SessionVersion,
+    load_session_snapshot,
+    load_session_version,
+)
 from app.core.logger import get_logger
 from app.core.settings import get_settings
 
@@ -21,75 +29,82 @@ LONG_TERM_TRIGGER_COUNT = settings.LONG_TERM_TRIGGER_COUNT
 class MemoryService:
     def __init__(
         self,
-        db: Session,
+        db: AsyncSession,
         redis_service: RedisChatService,
     ):
         self.db = db
         self.redis = redis_service
-        # NOTE: LLM is NOT shared - created per-call for thread safety
+        self.llm = LLMService()
 
     # =====================================================
     # REDIS COUNTER (AUTH_ID BASED)
     # =====================================================
 
-    def initialize_message_count(self, auth_id: str, user_id: int):
+    async def initialize_message_count(self, auth_id: str, user_id: int, count: int | None = None):
         """
         Call ONCE when WebSocket connection is established.
         Redis key uses auth_id, DB uses user_id.
+        Pass count when the caller already has it (e.g. from the session snapshot) to skip the DB.
         """
-        # If Redis already initialized, skip
-        if self.redis.get_count(auth_id) > 0:
+        # Reconnect fast path: trust the Redis counter whenever the key exists (including 0)
+        if await self.redis.has_count(auth_id):
             return
 
-        summary = self.get_long_term_summary(user_id)
-        last_id = summary.last_summarized_message_id if summary else 0
+        if count is not None:
+            await self.redis.init_count(auth_id, count)
+            return
 
+        summary = await self.get_long_term_summary(user_id)
+        last_id = (summary.last_summarized_message_id if summary else 0) or 0
 
-        stmt = select(ChatMessage.id).where(
+        # Server-side COUNT(*) over the composite (user_id, id) index
+        stmt = select(func.count(ChatMessage.id)).where(
             ChatMessage.user_id == user_id,
             ChatMessage.id > last_id,
         )
 
-        count = len(self.db.exec(stmt).all())
-        self.redis.init_count(auth_id, count)
+        count = (await self.db.exec(stmt)).one()
+        await self.redis.init_count(auth_id, count)
 
 
-    def increment_message_count(self, auth_id: str) -> int:
+    async def increment_message_count(self, auth_id: str) -> int:
         """
         Call on EVERY new message (user + assistant).
         """
-        return self.redis.incr_count(auth_id)
+        return await self.redis.incr_count(auth_id)
 
-    def should_update_summary(self, auth_id: str) -> bool:
+    async def should_update_summary(self, auth_id: str, count: int | None = None) -> bool:
         """
         Redis-only check with distributed lock to prevent duplicate threads.
         Returns True only if count >= threshold AND lock is acquired.
+        Pass count when the caller already has it (e.g. from push_and_count) to skip a GET.
         """
-        count = self.redis.get_count(auth_id)
+        if count is None:
+            count = await self.redis.get_count(auth_id)
         logger.info(f"Redis message count for {auth_id}: {count}")
         
         if count < LONG_TERM_TRIGGER_COUNT:
             return False
         
         # Try to acquire lock - prevents duplicate threads
-        if not self.redis.acquire_summary_lock(auth_id, ttl=120):
+        if not await self.redis.acquire_summary_lock(auth_id, ttl=120):
             logger.info(f"Summary lock already held for {auth_id}, skipping")
             return False
         
         return True
 
-    def reset_message_count(self, auth_id: str):
-        self.redis.reset_count(auth_id)
+    async def reset_message_count(self, auth_id: str):
+        await self.redis.reset_count(auth_id)
 
     # =====================================================
     # LONG-TERM SUMMARY (POSTGRES — USER_ID BASED)
     # =====================================================
 
-    def get_long_term_summary(self, user_id: int) -> UserSummary | None:
+    async def get_long_term_summary(self, user_id: int) -> UserSummary | None:
         stmt = select(UserSummary).where(UserSummary.user_id == user_id)
-        return self.db.exec(stmt).first()
+        return (await self.db.exec(stmt)).first()
 
-    def save_long_term_summary(
+    async def save_long_term_summary(
         self,
         user_id: int,
         summary: str,
@@ -97,7 +112,7 @@ class MemoryService:
         auth_id: str,
     ):
 
-        record = self.get_long_term_summary(user_id)
+        record = await self.get_long_term_summary(user_id)
         if record:
             record.long_summary = summary
             record.last_summarized_message_id = last_msg_id
@@ -111,32 +126,47 @@ class MemoryService:
                 )
             )
 
-        self.db.commit()
+        await self.db.commit()
 
         # Sync Redis cache (auth_id!)
-        self.redis.set_summary(auth_id, summary)
+        await self.redis.set_summary(auth_id, summary)
+
 
 
+    async def load_session_version(self, auth_id: str) -> SessionVersion | None:
+        """
+        The session's version stamp (and user id) alone, for the warm-reconnect check.
+        """
+        return await load_session_version(self.db, auth_id)
 
-    def load_user_context(self, auth_id: str, user_id: int) -> None:
+    async def load_session_snapshot(self, auth_id: str, limit: int) -> SessionSnapshot | None:
+        """
+        Profile, summary, recent window and unsummarized count in one query.
+        """
+        return await load_session_snapshot(self.db, auth_id, limit)
+
+    async def load_user_context(
+        self, auth_id: str, user_id: int, onboarding: UserOnboarding | None = None
+    ) -> None:
         """
         Loads user onboarding data into Redis as system context.
-        Called once during chat bootstrap.
+        Called once during chat bootstrap; pass onboarding when it is already loaded.
         """
         try:
             # Always refresh context during bootstrap to avoid the "Stale Profile" bug. 
             # This ensures that if a user updates their symptoms/info, the AI gets the latest data.
             logger.info(f"Loading user context for {auth_id}")
 
-            stmt = select(UserOnboarding).where(
-                UserOnboarding.auth_user_id == auth_id
-            )
-            onboarding = self.db.exec(stmt).first()
+            if onboarding is None:
+                stmt = select(UserOnboarding).where(
+                    UserOnboarding.auth_user_id == auth_id
+                )
+                onboarding = (await self.db.exec(stmt)).first()
             logger.info(f"User onboarding data: {onboarding}")
             # If onboarding not found, still mark as initialized
             if not onboarding:
                 logger.warning(f"No onboarding data found for {auth_id}, initializing empty context")
-                self.redis.set_user_context(auth_id, "")
+                await self.redis.set_user_context(auth_id, "")
                 return
 
             context_parts: list[str] = []
@@ -178,7 +208,7 @@ class MemoryService:
             user_context = "\n".join(context_parts)
 
             # Store in Redis (auth_id scoped)
-            self.redis.set_user_context(auth_id, user_context)
+            await self.redis.set_user_context(auth_id, user_context)
             logger.info(f"User context successfully loaded for {auth_id}")
 
         except Exception as e:
@@ -190,116 +220,106 @@ class MemoryService:
     # LLM SUMMARY UPDATE (ASYNC SAFE)
     # =====================================================
 
-    def update_summary_with_llm(self, auth_id: str, user_id: int):
+    async def summarize(self, auth_id: str, user_id: int) -> bool:
         """
-        Called ASYNC when Redis counter >= threshold.
-        Creates its own DB session since background tasks run after original session closes.
+        Summarizes messages after last_summarized_message_id into the long-term summary.
+        Idempotent per window and raises on failure, so queue consumers can retry it.
+        Returns True when a new summary was written.
         """
-        from app.database.database import engine  # Import here to avoid circular imports
-        from sqlmodel import Session
+        # Get existing summary
+        stmt = select(UserSummary).where(UserSummary.user_id == user_id)
+        summary_record = (await self.db.exec(stmt)).first()
         
-        logger.info(f"Updating summary for auth_id: {auth_id}")
+        old_summary = summary_record.long_summary if summary_record else ""
+        previous_last_id = summary_record.last_summarized_message_id if summary_record else None
+        last_id = previous_last_id or 0
+        logger.debug(f"Previous summary record: {summary_record}")
         
-        try:
-            with Session(engine) as db:
-                # Get existing summary
-                stmt = select(UserSummary).where(UserSummary.user_id == user_id)
-                summary_record = db.exec(stmt).first()
-                
-                old_summary = summary_record.long_summary if summary_record else ""
-                last_id = summary_record.last_summarized_message_id if summary_record else 0
-                logger.debug(f"Previous summary record: {summary_record}")
-                
-                # Get new messages
-                stmt = (
-                    select(ChatMessage)
-                    .where(
-                        ChatMessage.user_id == user_id,
-                        ChatMessage.id > last_id,
-                    )
-                    .order_by(ChatMessage.id.asc())
-                )
+        # Get new messages
+        stmt = (
+            select(ChatMessage)
+            .where(
+                ChatMessage.user_id == user_id,
+                ChatMessage.id > last_id,
+            )
+            .order_by(ChatMessage.id.asc())
+        )
 
-                messages: List[ChatMessage] = db.exec(stmt).all()
-                if not messages:
-                    logger.info(f"No new messages to summarize for {auth_id}")
-                    return
+        messages: List[ChatMessage] = (await self.db.exec(stmt)).all()
+        if not messages:
+            logger.info(f"No new messages to summarize for {auth_id}")
+            return False
 
-                convo = "\n".join(
-                    f"{m.role}: {m.message}" for m in messages
-                )
+        convo = "\n".join(
+            f"{m.role}: {m.message}" for m in messages
+        )
 
-                #TODO : As of now we are handling this in memory service but later on we shift this to llm service for single responsibility principle
-                # Note: Prompts are left-aligned to avoid leading whitespace token waste
-                prompt = ChatPromptTemplate.from_messages([
-                    (
-                        "system",
-                        """Your name is disha. You are a long-term medical summary assistant.
-
-RULES:
-- Keep under {max_words} words
-- Remove outdated or resolved symptoms
-- Preserve allergies, chronic conditions, preferences ans some important information that is useful for the user and our memory
-- Resolve contradictions"""
-                    ),
-                    (
-                        "user",
-                        """EXISTING SUMMARY:
-{old_summary}
-
-NEW MESSAGES:
-{conversation}
-
-OUTPUT:
-Updated summary only."""
-                    )
-                ])
-
-                # Create LLM client per-call for thread safety
-                llm = ChatOpenAI(
-                    api_key=settings.OPENROUTER_API_KEY,
-                    base_url=settings.OPENROUTER_BASE_URL,
-                    model=settings.OPENROUTER_MODEL,
-                    temperature=0,
-                    max_tokens=300,
+        # End the read transaction so the pooled connection isn't held during the LLM call
+        await self.db.commit()
+
+        new_summary = await self.llm.summarize(
+            old_summary=old_summary,
+            conversation=convo,
+            max_words=MAX_SUMMARY_WORDS,
+        )
+        last_msg_id = messages[-1].id
+
+        # Save to Postgres as a compare-and-set on last_summarized_message_id:
+        # a duplicate or concurrent run over the same window becomes a no-op.
+        if summary_record:
+            stmt = (
+                update(UserSummary)
+                .where(
+                    UserSummary.user_id == user_id,
+                    UserSummary.last_summarized_message_id.is_not_distinct_from(previous_last_id),
                 )
+                .values(
+                    long_summary=new_summary,
+                    last_summarized_message_id=last_msg_id,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+        else:
+            stmt = (
+                pg_insert(UserSummary)
+                .values(
+                    id=uuid.uuid4(),
+                    user_id=user_id,
+                    long_summary=new_summary,
+                    last_summarized_message_id=last_msg_id,
+                    updated_at=datetime.utcnow(),
+                )
+                .on_conflict_do_nothing(index_elements=["user_id"])
+            )
+
+        result = await self.db.exec(stmt)
+        await self.db.commit()
+
+        if result.rowcount == 0:
+            logger.info(f"Summary window after message {last_id} already processed for {auth_id}, skipping")
+            return False
 
-                chain = prompt | llm
-                response = chain.invoke({
-                    "max_words": MAX_SUMMARY_WORDS,
-                    "old_summary": old_summary,
-                    "conversation": convo,
-                })
-
-                new_summary = response.content.strip()
-                last_msg_id = messages[-1].id
-
-                # Save to Postgres
-                if summary_record:
-                    summary_record.long_summary = new_summary
-                    summary_record.last_summarized_message_id = last_msg_id
-                    summary_record.updated_at = datetime.utcnow()
-                else:
-                    db.add(
-                        UserSummary(
-                            user_id=user_id,
-                            long_summary=new_summary,
-                            last_summarized_message_id=last_msg_id,
-                        )
-                    )
-
-                db.commit()
-                logger.info(f"Summary updated successfully for {auth_id}")
-
-                # Sync Redis cache
-                self.redis.set_summary(auth_id, new_summary)
-
-                # Reset Redis counter
-                self.reset_message_count(auth_id)
-                
+        logger.info(f"Summary updated successfully for {auth_id}")
+
+        # Sync Redis cache
+        await self.redis.set_summary(auth_id, new_summary)
+
+        # Reset Redis counter
+        await self.reset_message_count(auth_id)
+        return True
+
+    async def update_summary_with_llm(self, auth_id: str, user_id: int):
+        """
+        Called ASYNC when Redis counter >= threshold.
+        Runs on a SummaryScheduler worker, which owns the DB session passed in as self.db.
+        """
+        logger.info(f"Updating summary for auth_id: {auth_id}")
+        
+        try:
+            await self.summarize(auth_id, user_id)
         except Exception as e:
             logger.error(f"Error updating summary for {auth_id}: {e}")
         finally:
             # Always release lock, even on error
-            self.redis.release_summary_lock(auth_id)
+            await self.redis.release_summary_lock(auth_id)
 
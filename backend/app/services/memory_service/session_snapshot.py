@@ -0,0 +1,189 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+from uuid import UUID
+
+from pydantic import BaseModel
+from sqlalchemy import JSON, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.user_model import UserOnboarding
+
+
+# One statement for everything chat bootstrap needs: profile, summary,
+# the recent message window (oldest first) and the unsummarized count.
+# Both laterals walk ix_chat_messages_user_id_id (backwards for id DESC).
+SESSION_SNAPSHOT_SQL = text(
+    """
+    WITH profile AS (
+        SELECT * FROM user_onboarding WHERE auth_user_id = :auth_id
+    )
+    SELECT
+        p.id AS user_id,
+        p.auth_user_id,
+        p.full_name,
+        p.age,
+        p.gender,
+        p.previous_diseases,
+        p.current_symptoms,
+        p.medications,
+        p.allergies,
+        p.additional_notes,
+        p.onboarding_completed,
+        p.updated_at,
+        s.long_summary,
+        s.last_summarized_message_id,
+        s.updated_at AS summary_updated_at,
+        recent.messages AS recent_messages,
+        recent.last_message_id,
+        unsummarized.count AS unsummarized_count
+    FROM profile p
+    LEFT JOIN user_summary s ON s.user_id = p.id
+    CROSS JOIN LATERAL (
+        SELECT
+            COALESCE(
+                json_agg(
+                    json_build_object('id', m.id, 'role', m.role, 'content', m.message)
+                    ORDER BY m.id
+                ),
+                '[]'::json
+            ) AS messages,
+            max(m.id) AS last_message_id
+        FROM (
+            SELECT id, role, message
+            FROM chat_messages
+            WHERE user_id = p.id
+            ORDER BY id DESC
+            LIMIT :limit
+        ) m
+    ) recent
+    CROSS JOIN LATERAL (
+        SELECT count(*) AS count
+        FROM chat_messages
+        WHERE user_id = p.id
+          AND id > COALESCE(s.last_summarized_message_id, 0)
+    ) unsummarized
+    """
+).columns(
+    previous_diseases=JSONB,
+    current_symptoms=JSONB,
+    medications=JSONB,
+    allergies=JSONB,
+    recent_messages=JSON,
+)
+
+# What the version stamp needs, and nothing more: checked on every connect so a
+# warm reconnect skips the snapshot. max(id) is one probe of the (user_id, id) index.
+SESSION_VERSION_SQL = text(
+    """
+    SELECT
+        p.id AS user_id,
+        p.updated_at,
+        s.updated_at AS summary_updated_at,
+        (SELECT max(id) FROM chat_messages WHERE user_id = p.id) AS last_message_id
+    FROM user_onboarding p
+    LEFT JOIN user_summary s ON s.user_id = p.id
+    WHERE p.auth_user_id = :auth_id
+    """
+)
+
+PROFILE_FIELDS = (
+    "auth_user_id",
+    "full_name",
+    "age",
+    "gender",
+    "previous_diseases",
+    "current_symptoms",
+    "medications",
+    "allergies",
+    "additional_notes",
+    "onboarding_completed",
+    "updated_at",
+)
+
+
+def _version_part(value: datetime | None) -> str:
+    """Normalizes timestamps (naive or tz-aware UTC) for the session version stamp."""
+    if value is None:
+        return ""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+def _version(
+    last_message_id: int, profile_updated_at: datetime | None, summary_updated_at: datetime | None
+) -> dict[str, str]:
+    return {
+        "last_message_id": str(last_message_id),
+        "profile": _version_part(profile_updated_at),
+        "summary": _version_part(summary_updated_at),
+    }
+
+
+class SessionVersion(BaseModel):
+    user_id: UUID
+    profile_updated_at: Optional[datetime] = None
+    summary_updated_at: Optional[datetime] = None
+    last_message_id: int = 0
+
+    def version(self) -> dict[str, str]:
+        """Same stamp as SessionSnapshot.version, from a much cheaper query."""
+        return _version(self.last_message_id, self.profile_updated_at, self.summary_updated_at)
+
+
+class SessionSnapshot(BaseModel):
+    user_id: UUID
+    profile: UserOnboarding
+    long_summary: str = ""
+    last_summarized_message_id: Optional[int] = None
+    summary_updated_at: Optional[datetime] = None
+    recent_messages: List[dict] = []
+    last_message_id: int = 0
+    unsummarized_count: int = 0
+
+    def version(self) -> dict[str, str]:
+        """Version stamp of everything bootstrap caches in Redis."""
+        return _version(self.last_message_id, self.profile.updated_at, self.summary_updated_at)
+
+
+async def load_session_version(db: AsyncSession, auth_id: str) -> SessionVersion | None:
+    """
+    Loads just the session version for auth_id.
+    Returns None when the user has no onboarding row.
+    """
+    result = await db.execute(SESSION_VERSION_SQL, {"auth_id": auth_id})
+    row = result.mappings().first()
+    if not row:
+        return None
+    return SessionVersion(
+        user_id=row["user_id"],
+        profile_updated_at=row["updated_at"],
+        summary_updated_at=row["summary_updated_at"],
+        last_message_id=row["last_message_id"] or 0,
+    )
+
+
+async def load_session_snapshot(
+    db: AsyncSession, auth_id: str, limit: int
+) -> SessionSnapshot | None:
+    """
+    Loads the session snapshot for auth_id in a single round-trip.
+    Returns None when the user has no onboarding row.
+    """
+    result = await db.execute(SESSION_SNAPSHOT_SQL, {"auth_id": auth_id, "limit": limit})
+    row = result.mappings().first()
+    if not row:
+        return None
+
+    profile = UserOnboarding(id=row["user_id"], **{field: row[field] for field in PROFILE_FIELDS})
+    return SessionSnapshot(
+        user_id=row["user_id"],
+        profile=profile,
+        long_summary=row["long_summary"] or "",
+        last_summarized_message_id=row["last_summarized_message_id"],
+        summary_updated_at=row["summary_updated_at"],
+        recent_messages=row["recent_messages"] or [],
+        last_message_id=row["last_message_id"] or 0,
+        unsummarized_count=row["unsummarized_count"],
+    )
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from uuid import UUID
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database.database import async_engine
+from app.services.redis_service.redis_service import RedisChatService
+from app.services.memory_service.memory_service import MemoryService
+from app.core.metrics import metrics
+from app.core.settings import get_settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+
+class SummaryScheduler:
+    """
+    Bounded pool of asyncio workers for long-term summary updates.
+
+    Jobs are fed by the should_update_summary lock, so at most one job per user
+    is queued or running. Concurrency caps both upstream LLM calls and the DB
+    connections used by summaries, so they can't starve the live chat path.
+    """
+
+    def __init__(self, concurrency: int, max_queue_size: int):
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._redis = RedisChatService()
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.concurrency)
+        ]
+        logger.info(f"Summary scheduler started with {self.concurrency} workers")
+
+    async def submit(self, auth_id: str, user_id: UUID) -> bool:
+        """
+        Queues a summary job. The caller must already hold the user's summary lock.
+        Returns False (and releases the lock) when the job can't be queued.
+        """
+        if self._queue is None:
+            logger.warning(f"Summary scheduler not running, skipping summary for {auth_id}")
+            await self._redis.release_summary_lock(auth_id)
+            return False
+
+        try:
+            self._queue.put_nowait((auth_id, user_id, time.perf_counter()))
+        except asyncio.QueueFull:
+            logger.warning(f"Summary queue full ({self.max_queue_size}), dropping job for {auth_id}")
+            metrics.incr("summary.jobs_dropped")
+            await self._redis.release_summary_lock(auth_id)
+            return False
+
+        metrics.set_gauge("summary.queue_depth", self._queue.qsize())
+        return True
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Lets queued jobs finish (up to timeout), then cancels the workers."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Summary scheduler shutdown timed out with {self._queue.qsize()} jobs pending")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Summary scheduler stopped")
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            auth_id, user_id, queued_at = await self._queue.get()
+            metrics.set_gauge("summary.queue_depth", self._queue.qsize())
+            metrics.observe("summary.queue_wait", time.perf_counter() - queued_at)
+
+            started = time.perf_counter()
+            try:
+                async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                    await MemoryService(db, self._redis).update_summary_with_llm(auth_id, user_id)
+                metrics.incr("summary.jobs_completed")
+            except Exception as e:
+                metrics.incr("summary.jobs_failed")
+                logger.error(f"Summary worker {index} failed for {auth_id}: {e}")
+            finally:
+                elapsed = time.perf_counter() - started
+                metrics.observe("summary.job_latency", elapsed)
+                logger.info(f"Summary job for {auth_id} finished in {elapsed * 1000:.0f} ms")
+                self._queue.task_done()
+
+
+summary_scheduler = SummaryScheduler(
+    concurrency=settings.SUMMARY_WORKER_CONCURRENCY,
+    max_queue_size=settings.SUMMARY_QUEUE_SIZE,
+)
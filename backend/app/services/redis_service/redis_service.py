@@ -3,11 +3,51 @@ from typing import List, Dict
 from uuid import UUID
 from app.core.redis import redis_client
 from app.core.settings import get_settings
+from app.schema.chat_schema import ChatContext
+
+# Frames that end a reply: nothing more will be buffered for it
+TERMINAL_REPLY_FRAMES = {"done", "message", "error"}
+
+# Compare-and-delete of the in-flight reply marker
+END_REPLY_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Client message claim values: "" while being answered, CLIENT_MSG_SAVED once the
+# message is saved but went unanswered, otherwise the cached reply
+CLIENT_MSG_SAVED = "\x00saved"
+
+# Claims a client message. Returns {"new"}, {"saved"} (a saved but unanswered
+# message, now taken over by this caller) or {"duplicate", <reply or "">}.
+CLAIM_CLIENT_MSG_SCRIPT = """
+local key = KEYS[1]
+local ttl = tonumber(ARGV[1])
+if redis.call('SET', key, '', 'NX', 'EX', ttl) then
+    return {'new'}
+end
+local value = redis.call('GET', key) or ''
+if value == ARGV[2] then
+    redis.call('SET', key, '', 'EX', ttl)
+    return {'saved'}
+end
+return {'duplicate', value}
+"""
+
+
+def parse_frame_id(value: str) -> tuple[int, int]:
+    """Splits a reply frame id ("<reply_id>-<seq>"); raises ValueError on malformed input."""
+    reply_id, _, seq = value.partition("-")
+    return int(reply_id), int(seq)
+
 
 class RedisChatService:
     def __init__(self):
         self.client = redis_client
         self.ttl = get_settings().REDIS_CACHE_EXPIRE
+        self._claim_client_msg = self.client.register_script(CLAIM_CLIENT_MSG_SCRIPT)
 
     def _messages_key(self, auth_id: UUID) -> str:
         return f"chat:{auth_id}:messages"
@@ -24,65 +64,203 @@ class RedisChatService:
     def _lock_key(self, auth_id: UUID) -> str:
         return f"chat:{auth_id}:summary_lock"
 
+    def _session_key(self, auth_id: UUID) -> str:
+        return f"chat:{auth_id}:session"
+
+    def _reply_key(self, auth_id: UUID, reply_id: int) -> str:
+        return f"chat:{auth_id}:reply:{reply_id}"
+
+    def _replies_key(self, auth_id: UUID) -> str:
+        return f"chat:{auth_id}:replies"
+
+    def _reply_active_key(self, auth_id: UUID) -> str:
+        return f"chat:{auth_id}:reply_active"
+
+    def _client_msg_key(self, auth_id: UUID, client_msg_id: str) -> str:
+        return f"chat:{auth_id}:client_msg:{client_msg_id}"
+
     # -------- messages --------
-    def exists(self, auth_id: UUID) -> bool:
-        return self.client.exists(self._messages_key(auth_id))
+    @staticmethod
+    def _dump_message(role: str, content: str, tokens: int | None = None) -> str:
+        message = {"role": role, "content": content}
+        if tokens is not None:
+            message["tokens"] = tokens
+        return json.dumps(message)
 
-    def get_messages(self, auth_id: UUID) -> List[Dict]:
-        msgs = self.client.lrange(self._messages_key(auth_id), 0, -1)
+    async def exists(self, auth_id: UUID) -> bool:
+        return await self.client.exists(self._messages_key(auth_id))
+
+    async def get_messages(self, auth_id: UUID) -> List[Dict]:
+        msgs = await self.client.lrange(self._messages_key(auth_id), 0, -1)
         return [json.loads(m) for m in msgs]
 
-    def push_message(self, auth_id: UUID, role: str, content: str, limit: int = 3):
+    async def push_message(self, auth_id: UUID, role: str, content: str, limit: int = 3):
         key = self._messages_key(auth_id)
         pipe = self.client.pipeline()
         pipe.rpush(key, json.dumps({"role": role, "content": content}))
         pipe.ltrim(key, -limit, -1)
         pipe.expire(key, self.ttl)
-        pipe.execute()
+        await pipe.execute()
+
+    async def push_and_fetch_context(
+        self,
+        auth_id: UUID,
+        role: str,
+        contents: List[str],
+        limit: int = 3,
+        tokens: List[int] | None = None,
+    ) -> ChatContext:
+        """
+        Single MULTI round-trip for the start of an exchange:
+        reads the prompt window (before these messages), pushes + trims the messages,
+        bumps the summary counter and reads summary + user context.
+        tokens is cached with each message so prompt assembly doesn't re-tokenize it.
+        """
+        key = self._messages_key(auth_id)
+        count_key = self._count_key(auth_id)
+        tokens = tokens or [None] * len(contents)
+
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        if contents:
+            pipe.rpush(key, *[self._dump_message(role, c, t) for c, t in zip(contents, tokens)])
+            pipe.ltrim(key, -limit, -1)
+            pipe.expire(key, self.ttl)
+            pipe.incrby(count_key, len(contents))
+            pipe.expire(count_key, self.ttl)
+        else:
+            # Nothing new to push (e.g. answering messages saved earlier): just read
+            pipe.get(count_key)
+        pipe.get(self._summary_key(auth_id))
+        pipe.get(self._user_context_key(auth_id))
+        results = await pipe.execute()
+        msgs, summary, user_context = results[0], results[-2], results[-1]
+        count = int(results[4] if contents else results[1] or 0)
 
-    def clear_messages(self, auth_id: UUID):
+        return ChatContext(
+            messages=[json.loads(m) for m in msgs],
+            summary=summary or "",
+            user_context=user_context or None,
+            count=count,
+        )
+
+    async def push_and_count(
+        self, auth_id: UUID, role: str, content: str, limit: int = 3, tokens: int | None = None
+    ) -> int:
+        """
+        Single MULTI round-trip for the end of an exchange:
+        pushes + trims the message and returns the incremented summary counter.
+        """
+        key = self._messages_key(auth_id)
+        count_key = self._count_key(auth_id)
+
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, self._dump_message(role, content, tokens))
+        pipe.ltrim(key, -limit, -1)
+        pipe.expire(key, self.ttl)
+        pipe.incr(count_key)
+        pipe.expire(count_key, self.ttl)
+        results = await pipe.execute()
+        return results[3]
+
+    async def replace_messages(self, auth_id: UUID, messages: List[Dict], limit: int = 3):
+        """
+        Atomically swaps in the whole message window: DEL + one multi-value RPUSH
+        in a single MULTI round-trip (used by bootstrap instead of per-message pushes).
+        """
+        key = self._messages_key(auth_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(key)
+        if messages:
+            pipe.rpush(key, *[json.dumps(m) for m in messages])
+            pipe.ltrim(key, -limit, -1)
+            pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def clear_messages(self, auth_id: UUID):
         """Removes the chat cache for a user"""
-        self.client.delete(self._messages_key(auth_id))
+        await self.client.delete(self._messages_key(auth_id))
 
     # -------- summary --------
-    def get_summary(self, auth_id: UUID) -> str:
-        return self.client.get(self._summary_key(auth_id)) or ""
+    async def get_summary(self, auth_id: UUID) -> str:
+        return await self.client.get(self._summary_key(auth_id)) or ""
 
-    def set_summary(self, auth_id: UUID, long_summary: str):
-        self.client.set(self._summary_key(auth_id), long_summary or "", ex=self.ttl)
+    async def set_summary(self, auth_id: UUID, long_summary: str):
+        await self.client.set(self._summary_key(auth_id), long_summary or "", ex=self.ttl)
 
-    def set_user_context(self, auth_id: UUID, context: str):
-        self.client.set(self._user_context_key(auth_id), context, ex=self.ttl)
+    async def set_user_context(self, auth_id: UUID, context: str):
+        await self.client.set(self._user_context_key(auth_id), context, ex=self.ttl)
 
-    def get_user_context(self, auth_id: UUID) -> str | None:
-        val = self.client.get(self._user_context_key(auth_id))
+    async def get_user_context(self, auth_id: UUID) -> str | None:
+        val = await self.client.get(self._user_context_key(auth_id))
         return val if val else None
 
     # -------------------------
     # LONG-TERM MESSAGE COUNT
     # -------------------------
 
-    def init_count(self, auth_id: UUID, count: int):
-        self.client.set(self._count_key(auth_id), count, ex=self.ttl)
+    async def init_count(self, auth_id: UUID, count: int):
+        await self.client.set(self._count_key(auth_id), count, ex=self.ttl)
+
+    async def has_count(self, auth_id: UUID) -> bool:
+        """True when the counter key exists, even if its value is 0."""
+        return await self.client.exists(self._count_key(auth_id)) > 0
 
-    def get_count(self, auth_id: UUID) -> int:
-        value = self.client.get(self._count_key(auth_id))
+    async def get_count(self, auth_id: UUID) -> int:
+        value = await self.client.get(self._count_key(auth_id))
         return int(value) if value else 0
 
-    def incr_count(self, auth_id: UUID) -> int:
+    async def incr_count(self, auth_id: UUID) -> int:
         key = self._count_key(auth_id)
-        count = self.client.incr(key)
-        self.client.expire(key, self.ttl)
+        count = await self.client.incr(key)
+        await self.client.expire(key, self.ttl)
         return count
 
-    def reset_count(self, auth_id: UUID):
-        self.client.set(self._count_key(auth_id), 0, ex=self.ttl)
+    async def reset_count(self, auth_id: UUID):
+        await self.client.set(self._count_key(auth_id), 0, ex=self.ttl)
+
+    # -------------------------
+    # SESSION VERSION STAMP
+    # -------------------------
+
+    async def is_session_current(self, auth_id: UUID, version: Dict[str, str]) -> bool:
+        """
+        True when the cached session was built from exactly this version
+        and its context keys are still present.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(self._session_key(auth_id))
+        pipe.exists(self._summary_key(auth_id), self._user_context_key(auth_id), self._count_key(auth_id))
+        cached, present = await pipe.execute()
+        return cached == version and present == 3
+
+    async def set_session_version(self, auth_id: UUID, version: Dict[str, str]):
+        key = self._session_key(auth_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping=version)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def set_session_last_message_ids(self, last_ids: Dict[str, int]):
+        """
+        Advances the message part of the version stamp once messages are persisted,
+        so the live-updated Redis window keeps matching Postgres.
+        """
+        if not last_ids:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for auth_id, last_id in last_ids.items():
+            key = self._session_key(auth_id)
+            pipe.hset(key, "last_message_id", str(last_id))
+            pipe.expire(key, self.ttl)
+        await pipe.execute()
 
     # -------------------------
     # DISTRIBUTED LOCKING
     # -------------------------
 
-    def acquire_summary_lock(self, auth_id: UUID, ttl: int = 60) -> bool:
+    async def acquire_summary_lock(self, auth_id: UUID, ttl: int = 60) -> bool:
         """
         Try to acquire a distributed lock for summary update.
         Returns True if lock acquired, False if already locked.
@@ -90,12 +268,147 @@ class RedisChatService:
         """
         lock_key = self._lock_key(auth_id)
         # SET with NX (only if not exists) and EX (expire time)
-        acquired = self.client.set(lock_key, "1", nx=True, ex=ttl)
+        acquired = await self.client.set(lock_key, "1", nx=True, ex=ttl)
         return acquired is not None
 
-    def release_summary_lock(self, auth_id: UUID):
+    async def release_summary_lock(self, auth_id: UUID):
         """
         Release the distributed lock after summary update completes.
         """
-        self.client.delete(self._lock_key(auth_id))
+        await self.client.delete(self._lock_key(auth_id))
+
+    # -------------------------
+    # SUMMARY JOB STREAM
+    # -------------------------
+
+    async def enqueue_summary_job(self, auth_id: UUID, user_id: UUID) -> str:
+        """
+        Appends a summarization job to the Redis Stream consumed by app.workers.summarizer.
+        """
+        settings = get_settings()
+        return await self.client.xadd(
+            settings.SUMMARY_STREAM_KEY,
+            {"auth_id": str(auth_id), "user_id": str(user_id)},
+            maxlen=settings.SUMMARY_STREAM_MAXLEN,
+            approximate=True,
+        )
+
+    # -------------------------
+    # REPLY REPLAY BUFFER
+    # -------------------------
+
+    # Reply ids are the reply's start time in ms, frames are scored by their seq,
+    # so a frame id "<reply_id>-<seq>" locates it without a lookup.
+    # The queue_* helpers only add commands to the caller's pipeline.
+
+    def queue_begin_reply(self, pipe, auth_id: UUID, reply_id: int):
+        """Registers a reply as the user's latest and marks it in flight."""
+        settings = get_settings()
+        replies_key = self._replies_key(auth_id)
+        pipe.zadd(replies_key, {reply_id: reply_id})
+        pipe.zremrangebyrank(replies_key, 0, -settings.CHAT_REPLY_BUFFER_REPLIES - 1)
+        pipe.expire(replies_key, settings.CHAT_REPLY_BUFFER_TTL)
+        pipe.set(self._reply_active_key(auth_id), reply_id, ex=settings.CHAT_REPLY_BUFFER_TTL)
+
+    def queue_reply_frame(self, pipe, auth_id: UUID, reply_id: int, seq: int, frame: dict):
+        ttl = get_settings().CHAT_REPLY_BUFFER_TTL
+        key = self._reply_key(auth_id, reply_id)
+        pipe.zadd(key, {json.dumps(frame): seq})
+        pipe.expire(key, ttl)
+        pipe.expire(self._reply_active_key(auth_id), ttl)
+
+    def queue_end_reply(self, pipe, auth_id: UUID, reply_id: int):
+        """Clears the in-flight marker, unless a later reply of the user already took it over."""
+        pipe.eval(END_REPLY_SCRIPT, 1, self._reply_active_key(auth_id), reply_id)
+
+    async def is_reply_active(self, auth_id: UUID) -> bool:
+        return await self.client.exists(self._reply_active_key(auth_id)) > 0
+
+    async def get_reply_frames(self, auth_id: UUID, reply_id: int, after_seq: int = -1) -> List[Dict]:
+        frames = await self.client.zrangebyscore(self._reply_key(auth_id, reply_id), f"({after_seq}", "+inf")
+        return [json.loads(frame) for frame in frames]
+
+    async def replay_reply_frames(self, auth_id: UUID, last_id: str) -> tuple[bool, List[Dict]]:
+        """
+        Returns the frames buffered after last_id: the rest of that reply, then any
+        later replies. The bool is False when the buffer no longer holds last_id's
+        reply (expired or trimmed) and the client has to reload history instead.
+        """
+        try:
+            reply_id, seq = parse_frame_id(last_id)
+        except ValueError:
+            return False, []
+
+        replies_key = self._replies_key(auth_id)
+        reply_key = self._reply_key(auth_id, reply_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zscore(replies_key, reply_id)
+        pipe.exists(reply_key)
+        pipe.zrangebyscore(reply_key, f"({seq}", "+inf")
+        pipe.zrangebyscore(replies_key, f"({reply_id}", "+inf")
+        known, present, frames, later = await pipe.execute()
+        if known is None or not present:
+            return False, []
+
+        if later:
+            pipe = self.client.pipeline(transaction=False)
+            for later_id in later:
+                pipe.zrange(self._reply_key(auth_id, later_id), 0, -1)
+            for later_frames in await pipe.execute():
+                frames.extend(later_frames)
+        return True, [json.loads(frame) for frame in frames]
+
+    # -------------------------
+    # CLIENT MESSAGE DEDUP
+    # -------------------------
+
+    async def claim_client_message(self, auth_id: UUID, client_msg_id: str) -> tuple[str, str | None]:
+        """
+        Claims client_msg_id for the dedup window. Returns ("new", None) for a new
+        message and ("saved", None) for a retry of one that was saved but never
+        answered (answer it, don't save it again). Any other retry gets
+        ("duplicate", reply): the cached reply, or None while it is still being answered.
+        """
+        result = await self._claim_client_msg(
+            keys=[self._client_msg_key(auth_id, client_msg_id)],
+            args=[get_settings().CHAT_CLIENT_MSG_DEDUP_TTL, CLIENT_MSG_SAVED],
+        )
+        state = result[0]
+        if state in ("new", "saved"):
+            return state, None
+        return state, result[1] or None
+
+    async def complete_client_messages(self, auth_id: UUID, client_msg_ids: List[str], reply: str):
+        """Stores the reply so retries of these messages are answered from cache."""
+        # "" marks a claim still being answered; never cache it as the reply
+        if not client_msg_ids or not reply:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for client_msg_id in client_msg_ids:
+            pipe.set(
+                self._client_msg_key(auth_id, client_msg_id),
+                reply,
+                xx=True,
+                ex=get_settings().CHAT_CLIENT_MSG_DEDUP_TTL,
+            )
+        await pipe.execute()
+
+    async def mark_client_messages_saved(self, auth_id: UUID, client_msg_ids: List[str]):
+        """Marks claimed messages as saved but unanswered, so a retry gets a reply without a second save."""
+        if not client_msg_ids:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for client_msg_id in client_msg_ids:
+            pipe.set(
+                self._client_msg_key(auth_id, client_msg_id),
+                CLIENT_MSG_SAVED,
+                xx=True,
+                ex=get_settings().CHAT_CLIENT_MSG_DEDUP_TTL,
+            )
+        await pipe.execute()
 
+    async def release_client_messages(self, auth_id: UUID, client_msg_ids: List[str]):
+        """Forgets unanswered messages so a retry is processed again."""
+        if not client_msg_ids:
+            return
+        await self.client.delete(*(self._client_msg_key(auth_id, i) for i in client_msg_ids))
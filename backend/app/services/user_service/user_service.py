@@ -1,10 +1,12 @@
 # app/services/user_service.py
+from datetime import datetime
 from sqlmodel import Session, select
 from app.models.user_model import UserOnboarding
 from app.schema.user_schema import (
     OnboardingCreateRequest,
     OnboardingUpdateRequest,
 )
+from app.core.user_cache import user_id_cache
 from app.core.logger import get_logger
 
 logger = get_logger(__name__)
@@ -30,6 +32,21 @@ class UserService:
 
         return onboarding
 
+    def get_user_id(self, auth_id):
+        """
+        Resolves auth_id -> UserOnboarding.id, served from the process-local cache when possible.
+        """
+        user_id = user_id_cache.get(auth_id)
+        if user_id is not None:
+            return user_id
+
+        user_id = self.db.exec(
+            select(UserOnboarding.id).where(UserOnboarding.auth_user_id == auth_id)
+        ).first()
+        if user_id is not None:
+            user_id_cache.set(auth_id, user_id)
+        return user_id
+
     def get_onboarding(self, auth_user_id):
         return self.ensure_user_state(auth_user_id)
 
@@ -43,6 +60,7 @@ class UserService:
             setattr(onboarding, key, value)
 
         onboarding.onboarding_completed = True
+        onboarding.updated_at = datetime.utcnow()
         logger.info(f"Onboarding created for user {onboarding.auth_user_id}")
         self.db.add(onboarding)
         self.db.commit()
@@ -57,10 +75,13 @@ class UserService:
             setattr(onboarding, key, value)
 
         onboarding.onboarding_completed = True
+        # Bumps the chat session version so the next bootstrap reloads the profile
+        onboarding.updated_at = datetime.utcnow()
 
         self.db.add(onboarding)
         self.db.commit()
         self.db.refresh(onboarding)
+        user_id_cache.invalidate(auth_id)
         logger.info(f"Onboarding updated successfully for user {auth_id}")
 
         return onboarding
@@ -0,0 +1,171 @@
+"""
+Out-of-process long-term summary worker.
+
+Consumes summarization jobs from a Redis Stream consumer group so LLM-heavy
+summary work can be scaled separately from the WebSocket API pods:
+
+    python -m app.workers.summarizer
+
+Delivery is at-least-once: a job is XACKed only after MemoryService.summarize
+succeeds. Jobs left pending by a crashed or failing consumer are reclaimed with
+XAUTOCLAIM after SUMMARY_CLAIM_IDLE_MS and retried; after SUMMARY_MAX_ATTEMPTS
+deliveries (or straight away, if malformed) they are moved to the dead-letter
+stream. Redis errors while reading are logged and retried. Re-running a job is safe
+because the summary save is a compare-and-set on last_summarized_message_id.
+"""
+import asyncio
+import os
+import signal
+import socket
+from uuid import UUID
+
+from redis.exceptions import ResponseError
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.logger import setup_logging, get_logger
+from app.core.redis import redis_client, close_redis
+from app.core.llm_client import close_llm_client
+from app.core.settings import get_settings
+from app.database.database import async_engine
+from app.services.redis_service.redis_service import RedisChatService
+from app.services.memory_service.memory_service import MemoryService
+
+logger = get_logger(__name__)
+settings = get_settings()
+
+
+class SummaryStreamWorker:
+    def __init__(self, consumer: str, concurrency: int):
+        self.consumer = consumer
+        self.concurrency = concurrency
+        self.stream = settings.SUMMARY_STREAM_KEY
+        self.group = settings.SUMMARY_STREAM_GROUP
+        self.client = redis_client
+        self.redis = RedisChatService()
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        logger.info("Summary worker stopping after current batch")
+        self._stopping.set()
+
+    async def ensure_group(self) -> None:
+        try:
+            await self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.stream}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def run(self) -> None:
+        await self.ensure_group()
+        logger.info(f"Summary worker {self.consumer} consuming {self.stream}")
+
+        while not self._stopping.is_set():
+            try:
+                entries = await self._next_entries()
+            except Exception as e:
+                # Redis blip: back off and keep consuming instead of killing the worker
+                logger.error(f"Summary worker failed to read {self.stream}: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if entries:
+                results = await asyncio.gather(
+                    *(self._handle(entry_id, fields) for entry_id, fields in entries),
+                    return_exceptions=True,
+                )
+                for (entry_id, _), result in zip(entries, results):
+                    if isinstance(result, Exception):
+                        # Left pending: XAUTOCLAIM redelivers it after SUMMARY_CLAIM_IDLE_MS
+                        logger.error(f"Summary job {entry_id} failed: {result!r}")
+
+    async def _next_entries(self) -> list:
+        # 1. Retry jobs another consumer (or this one) left pending for too long
+        _, claimed, *_ = await self.client.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=settings.SUMMARY_CLAIM_IDLE_MS,
+            start_id="0-0",
+            count=self.concurrency,
+        )
+        entries = [entry for entry in claimed if entry and entry[1]]
+        if entries:
+            return entries
+
+        # 2. Otherwise wait for new jobs
+        response = await self.client.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: ">"},
+            count=self.concurrency,
+            # Stay below REDIS_SOCKET_TIMEOUT so the blocking read doesn't time out the socket
+            block=2000,
+        )
+        return [entry for _, stream_entries in response for entry in stream_entries]
+
+    async def _attempts(self, entry_id: str) -> int:
+        pending = await self.client.xpending_range(
+            self.stream, self.group, min=entry_id, max=entry_id, count=1
+        )
+        return pending[0]["times_delivered"] if pending else 1
+
+    async def _dead_letter(self, entry_id: str, fields: dict, **details) -> None:
+        await self.client.xadd(
+            settings.SUMMARY_DEAD_LETTER_KEY,
+            {**fields, "job_id": entry_id, **details},
+            maxlen=settings.SUMMARY_STREAM_MAXLEN,
+            approximate=True,
+        )
+        await self.client.xack(self.stream, self.group, entry_id)
+
+    async def _handle(self, entry_id: str, fields: dict) -> None:
+        try:
+            auth_id = fields["auth_id"]
+            user_id = UUID(fields["user_id"])
+        except (KeyError, TypeError, ValueError) as e:
+            # Retrying can't fix a malformed job: park it straight away
+            logger.error(f"Malformed summary job {entry_id} ({e!r}), dead-lettering")
+            await self._dead_letter(entry_id, fields, error=f"malformed: {e!r}")
+            return
+
+        try:
+            attempts = await self._attempts(entry_id)
+            if attempts > settings.SUMMARY_MAX_ATTEMPTS:
+                logger.error(f"Summary job {entry_id} for {auth_id} failed {attempts - 1} times, dead-lettering")
+                await self._dead_letter(entry_id, fields, attempts=attempts - 1)
+                await self.redis.release_summary_lock(auth_id)
+                return
+
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                await MemoryService(db, self.redis).summarize(auth_id, user_id)
+        except Exception as e:
+            # Left pending: XAUTOCLAIM redelivers it after SUMMARY_CLAIM_IDLE_MS
+            logger.error(f"Summary job {entry_id} for {auth_id} failed: {e}")
+            return
+
+        await self.client.xack(self.stream, self.group, entry_id)
+        await self.redis.release_summary_lock(auth_id)
+        logger.info(f"Summary job {entry_id} for {auth_id} done")
+
+
+async def main() -> None:
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    worker = SummaryStreamWorker(consumer=consumer, concurrency=settings.SUMMARY_WORKER_CONCURRENCY)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await close_redis()
+        await close_llm_client()
+        await async_engine.dispose()
+        logger.info("Summary worker stopped")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(main())
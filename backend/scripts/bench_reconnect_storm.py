@@ -0,0 +1,69 @@
+"""
+Reconnect-storm benchmark for the Redis side of ChatService.bootstrap_context.
+
+Simulates N clients reconnecting at once and compares the old cache reload
+(DEL + one push_message round-trip per message) with replace_messages
+(one MULTI with a multi-value RPUSH). Needs a running Redis from Settings.
+
+    python -m scripts.bench_reconnect_storm --clients 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from app.core.redis import close_redis
+from app.core.settings import get_settings
+from app.services.redis_service.redis_service import RedisChatService
+
+settings = get_settings()
+
+
+async def reload_per_message(redis: RedisChatService, auth_id: str, messages: list[dict], limit: int):
+    await redis.clear_messages(auth_id)
+    for msg in messages:
+        await redis.push_message(auth_id, role=msg["role"], content=msg["content"], limit=limit)
+
+
+async def reload_bulk(redis: RedisChatService, auth_id: str, messages: list[dict], limit: int):
+    await redis.replace_messages(auth_id, messages, limit=limit)
+
+
+async def storm(name, reload, redis, auth_ids, messages, limit, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def reconnect(auth_id):
+        async with semaphore:
+            await reload(redis, auth_id, messages, limit)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(reconnect(auth_id) for auth_id in auth_ids))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<16} {len(auth_ids):>6} reconnects in {elapsed:7.3f}s  ->  {len(auth_ids) / elapsed:9.0f} reconnects/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=settings.CHAT_CACHE_LIMIT)
+    args = parser.parse_args()
+
+    redis = RedisChatService()
+    auth_ids = [f"bench-{uuid.uuid4()}" for _ in range(args.clients)]
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"benchmark message {i} " * 20}
+        for i in range(args.limit)
+    ]
+
+    try:
+        await storm("per-message", reload_per_message, redis, auth_ids, messages, args.limit, args.concurrency)
+        await storm("replace_messages", reload_bulk, redis, auth_ids, messages, args.limit, args.concurrency)
+    finally:
+        for auth_id in auth_ids:
+            await redis.clear_messages(auth_id)
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,7 +4,7 @@ import api from '../lib/axios';
 import { Button } from '../components/ui/Button';
 import { useNavigate } from 'react-router-dom';
 import { motion, AnimatePresence } from 'framer-motion';
-import { ArrowLeft, Send, MoreVertical, Phone, Video, Check, CheckCheck, Plus, Smile, Mic } from 'lucide-react';
+import { ArrowLeft, Send, MoreVertical, Phone, Video, Check, CheckCheck, Plus, Smile, Mic, Square } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
 
 // Types
@@ -17,13 +17,31 @@ interface Message {
 }
 
 interface WSMessage {
-    type: 'history' | 'message' | 'error';
+    type: 'history' | 'message' | 'delta' | 'done' | 'error' | 'resumed' | 'ack';
+    id?: string | null; // reply buffer id ("<ms>-<seq>"), echoed back as last_id on resume
     role?: 'user' | 'assistant';
     content?: string | any; // history content is list
     message?: string; // from API
     messages?: Array<{ role: string, content: string }>;
+    ok?: boolean;
+    client_msg_id?: string;
+    stopped?: boolean;
 }
 
+// Lets the server recognise a retried message (crypto.randomUUID needs a secure context)
+const newClientMsgId = () =>
+    window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+const sendChatMessage = (socket: WebSocket, clientMsgId: string, text: string) =>
+    socket.send(JSON.stringify({ type: 'message', content: text, client_msg_id: clientMsgId }));
+
+// Orders reply buffer ids ("<ms>-<seq>")
+const compareFrameIds = (a: string, b: string) => {
+    const [aMs, aSeq] = a.split('-').map(Number);
+    const [bMs, bSeq] = b.split('-').map(Number);
+    return aMs - bMs || aSeq - bSeq;
+};
+
 const Chat = () => {
     const { user } = useAuth();
     const navigate = useNavigate();
@@ -31,34 +49,39 @@ const Chat = () => {
     const [inputValue, setInputValue] = useState('');
     const [isConnected, setIsConnected] = useState(false);
     const [isTyping, setIsTyping] = useState(false);
+    const [isGenerating, setIsGenerating] = useState(false);
 
     // Pagination state
     const [isLoadingHistory, setIsLoadingHistory] = useState(false);
     const [hasMore, setHasMore] = useState(true);
-    const [offset, setOffset] = useState(0);
+    const [cursor, setCursor] = useState<number | null>(null);
     const limit = 20;
 
     const ws = useRef<WebSocket | null>(null);
+    // Last reply frame received; survives reconnects so missed frames can be replayed
+    const lastFrameIdRef = useRef<string | null>(null);
+    // Messages the server hasn't acknowledged yet (client_msg_id -> text), resent on reconnect
+    const outboxRef = useRef<Map<string, string>>(new Map());
     const messagesEndRef = useRef<HTMLDivElement>(null);
     const containerRef = useRef<HTMLDivElement>(null);
     const prevScrollHeightRef = useRef<number>(0);
 
     // Fetch history
-    const fetchHistory = useCallback(async (currentOffset: number) => {
+    const fetchHistory = useCallback(async (beforeId: number | null) => {
         try {
             setIsLoadingHistory(true);
             const response = await api.get('/chat/history', {
                 params: {
                     limit: limit,
-                    offset: currentOffset,
+                    // Keyset pagination: older pages are requested by the last seen message id
+                    ...(beforeId !== null && { before_id: beforeId }),
                 }
             });
 
             const apiRes = response.data;
             const data = apiRes.data || [];
-            if (data.length < limit) {
-                setHasMore(false);
-            }
+            setHasMore(apiRes.next_cursor != null);
+            setCursor(apiRes.next_cursor ?? null);
 
             const formattedMessages: Message[] = data.map((msg: any) => ({
                 id: msg.id,
@@ -68,7 +91,7 @@ const Chat = () => {
                 status: 'delivered'
             })).reverse(); // API gives newest first, we want oldest first for chat flow
 
-            if (currentOffset === 0) {
+            if (beforeId === null) {
                 setMessages(formattedMessages);
                 scrollToBottom('auto');
             } else {
@@ -98,11 +121,9 @@ const Chat = () => {
         if (!containerRef.current) return;
         const { scrollTop, scrollHeight } = containerRef.current;
 
-        if (scrollTop === 0 && hasMore && !isLoadingHistory) {
+        if (scrollTop === 0 && hasMore && !isLoadingHistory && cursor !== null) {
             prevScrollHeightRef.current = scrollHeight;
-            const newOffset = messages.length;
-            setOffset(newOffset);
-            fetchHistory(newOffset);
+            fetchHistory(cursor);
         }
     };
 
@@ -116,6 +137,15 @@ const Chat = () => {
 
         const connect = () => {
             if (!isMounted) return;
+            // Reply frames received while a resume is pending (replayed and live ones may interleave)
+            let resumeQueue: WSMessage[] | null = null;
+
+            // Safe to repeat: the server answers a client_msg_id only once
+            const flushOutbox = () => {
+                outboxRef.current.forEach((text, clientMsgId) => {
+                    if (socket) sendChatMessage(socket, clientMsgId, text);
+                });
+            };
 
             const token = localStorage.getItem('token');
 
@@ -146,18 +176,113 @@ const Chat = () => {
                 if (!isMounted) return;
                 console.log('Connected to chat');
                 setIsConnected(true);
-                // Auto-refresh chat on connection (handles initial load & reconnection)
-                fetchHistory(0);
+                if (lastFrameIdRef.current) {
+                    // Reconnect: replay the reply frames missed while offline instead of reloading
+                    resumeQueue = [];
+                    socket?.send(JSON.stringify({ type: 'resume', last_id: lastFrameIdRef.current }));
+                } else {
+                    // Auto-refresh chat on connection (initial load)
+                    fetchHistory(null);
+                    flushOutbox();
+                }
+            };
+
+            const acceptFrame = (data: WSMessage) => {
+                if (data.id) {
+                    // Already seen (replay and fan-out can both deliver a frame)
+                    if (lastFrameIdRef.current && compareFrameIds(data.id, lastFrameIdRef.current) <= 0) return;
+                    lastFrameIdRef.current = data.id;
+                }
+                handleFrame(data);
             };
 
             socket.onmessage = (event) => {
                 if (!isMounted) return;
                 const data: WSMessage = JSON.parse(event.data);
 
+                if (data.type === 'resumed') {
+                    const queued = (resumeQueue || []).sort((a, b) => compareFrameIds(a.id!, b.id!));
+                    resumeQueue = null;
+                    if (!data.ok) {
+                        // Buffer expired: fall back to a full reload
+                        lastFrameIdRef.current = null;
+                        fetchHistory(null);
+                    } else {
+                        queued.forEach(acceptFrame);
+                    }
+                    // Only after the replay, so a reply that already arrived isn't requested again
+                    flushOutbox();
+                } else if (data.type === 'ack' && data.client_msg_id) {
+                    outboxRef.current.delete(data.client_msg_id);
+                } else if (data.id && resumeQueue) {
+                    resumeQueue.push(data);
+                } else {
+                    acceptFrame(data);
+                }
+            };
+
+            const handleFrame = (data: WSMessage) => {
                 if (data.type === 'history' && data.messages) {
                     console.log("WS History received (ignoring in favor of API)");
+                } else if (data.type === 'delta') {
+                    // Streamed reply: append tokens to the in-progress assistant bubble
+                    setIsTyping(false);
+                    setMessages(prev => {
+                        const newMessages = [...prev];
+                        const last = newMessages[newMessages.length - 1];
+                        if (last && last.role === 'assistant' && last.status === 'sent') {
+                            newMessages[newMessages.length - 1] = { ...last, content: last.content + (data.content as string) };
+                            return newMessages;
+                        }
+                        for (let i = newMessages.length - 1; i >= 0; i--) {
+                            if (newMessages[i].role === 'user' && newMessages[i].status === 'sent') {
+                                newMessages[i] = { ...newMessages[i], status: 'delivered' };
+                                break;
+                            }
+                        }
+                        return [...newMessages, {
+                            id: Date.now(),
+                            role: 'assistant',
+                            content: data.content as string,
+                            created_at: new Date().toISOString(),
+                            status: 'sent'
+                        }];
+                    });
+                    scrollToBottom();
+                } else if (data.type === 'done') {
+                    setIsTyping(false);
+                    setIsGenerating(false);
+                    setMessages(prev => {
+                        const newMessages = [...prev];
+                        const last = newMessages[newMessages.length - 1];
+                        if (last && last.role === 'assistant' && last.status === 'sent') {
+                            newMessages[newMessages.length - 1] = { ...last, content: data.content as string, status: 'delivered' };
+                            return newMessages;
+                        }
+                        // Stopped before any text was generated: nothing to show
+                        if (data.stopped && !data.content) return newMessages;
+                        return [...newMessages, {
+                            id: Date.now(),
+                            role: 'assistant',
+                            content: data.content as string,
+                            created_at: new Date().toISOString(),
+                            status: 'delivered'
+                        }];
+                    });
+                } else if (data.type === 'message' && data.role === 'user') {
+                    // Sent from another device of this user: mirror it, a reply is on its way
+                    setIsTyping(true);
+                    setMessages(prev => [...prev, {
+                        id: Date.now(),
+                        role: 'user',
+                        content: data.content as string,
+                        created_at: new Date().toISOString(),
+                        status: 'delivered'
+                    }]);
+                    scrollToBottom();
                 } else if (data.type === 'message') {
                     setIsTyping(false);
+                    setIsGenerating(false);
                     const newMsg: Message = {
                         id: Date.now(),
                         role: data.role as 'user' | 'assistant',
@@ -181,6 +306,7 @@ const Chat = () => {
                 } else if (data.type === 'error') {
                     console.error("WS Error:", data.message || "Unknown error");
                     setIsTyping(false);
+                    setIsGenerating(false);
                 }
             };
 
@@ -188,6 +314,7 @@ const Chat = () => {
                 if (!isMounted) return;
                 console.log('Disconnected. Attempting to reconnect in 3s...');
                 setIsConnected(false);
+                setIsGenerating(false);
 
                 // Try to reconnect
                 reconnectTimer = setTimeout(() => {
@@ -222,6 +349,7 @@ const Chat = () => {
         if (!inputValue.trim() || !ws.current) return;
 
         const text = inputValue.trim();
+        const clientMsgId = newClientMsgId();
 
         // Optimistic update
         const userMsg: Message = {
@@ -235,8 +363,20 @@ const Chat = () => {
         setInputValue('');
         scrollToBottom();
         setIsTyping(true); // Artificial typing indicator for "Waiting for reply"
+        setIsGenerating(true);
+
+        // Kept until acknowledged; if the socket is down it goes out on reconnect
+        outboxRef.current.set(clientMsgId, text);
+        if (ws.current.readyState === WebSocket.OPEN) {
+            sendChatMessage(ws.current, clientMsgId, text);
+        }
+    };
 
-        ws.current.send(text);
+    const handleStop = () => {
+        if (!ws.current) return;
+        // Server cancels the in-flight reply and closes the turn with a 'done' frame
+        ws.current.send(JSON.stringify({ type: 'stop' }));
+        setIsTyping(false);
     };
 
     // Placeholder for history fetching
@@ -292,7 +432,7 @@ const Chat = () => {
             >
                 <div className="absolute inset-0 bg-slate-950/40 pointer-events-none" />
 
-                {isLoadingHistory && offset > 0 && (
+                {isLoadingHistory && messages.length > 0 && (
                     <div className="flex justify-center p-2 relative z-10">
                         <span className="w-5 h-5 border-2 border-yellow-500/50 border-t-yellow-500 rounded-full animate-spin"></span>
                     </div>
@@ -408,6 +548,14 @@ const Chat = () => {
                     >
                         <Send className="w-5 h-5" />
                     </motion.button>
+                ) : isGenerating ? (
+                    <button
+                        onClick={handleStop}
+                        disabled={!isConnected}
+                        className="w-10 h-10 sm:w-12 sm:h-12 bg-slate-800 hover:bg-slate-700 text-yellow-500 rounded-full flex items-center justify-center shadow-lg shrink-0 disabled:opacity-50"
+                    >
+                        <Square className="w-4 h-4 fill-current" />
+                    </button>
                 ) : (
                     <button
                         className="w-10 h-10 sm:w-12 sm:h-12 bg-slate-800 text-slate-400 rounded-full flex items-center justify-center shadow-lg shrink-0 disabled:opacity-50"